@@ -0,0 +1,433 @@
+#!/usr/bin/python3
+"""
+Module benchmark
+
+Offline benchmark of the monitorVW export pipeline.
+
+Recorded or synthetic WeConnect payloads are replayed through the same
+functions used by monitorVW (status update, storeCarStatusData,
+storeTripData with fetchTripData/parseTrips, tripToInflux and tripToCsv).
+Points are written through the InfluxDB client and InfluxSink to a local
+InfluxDB stand-in; csv and Parquet files are written to a temporary directory.
+
+With --collector, cycles are run in-process by a monitorVW Collector
+with injected stand-ins, including trip state and trip cache.
+
+Reported are cycles/sec, points/sec and peak memory.
+With --serializer, only the serialization of trips to line protocol is measured,
+comparing influxdb_client Points with the serializer used by monitorVW.
+With --baseline, results are compared to a previous run (--json)
+and the benchmark fails if throughput dropped by more than --tolerance percent.
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import influxdb_client
+from influxdb_client.client.write_api import SYNCHRONOUS
+from weconnect.domain import Domain
+from monitorVW.collector import Collector
+from monitorVW.csvSink import CsvSinkPool, FSYNC_POLICIES
+from monitorVW.export import (
+    TRIPDATA,
+    measurementTimestamp,
+    storeCarStatusData,
+    storeTripData,
+)
+from monitorVW.influxSink import InfluxSink
+from monitorVW.lineProtocol import TripSerializer
+from monitorVW.parquetSink import ParquetSinkPool
+from monitorVW.statusMapping import StatusExtractor
+from monitorVW.tripRecord import parseTrips
+from monitorVW.tripState import TripState
+from standins import (
+    TRIPTYPES,
+    FakeSession,
+    FakeWeConnect,
+    InfluxStandIn,
+    loadFixtures,
+    syntheticStatus,
+    syntheticTrips,
+)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+ORG = "benchmark"
+BUCKET = "status"
+TRIPBUCKET = "trips"
+
+
+def getCl():
+    """
+    Get command line parameters
+    """
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of the monitorVW export pipeline"
+    )
+    parser.add_argument(
+        "--fixtures",
+        help="Directory with recorded payloads (default: benchmarks/fixtures)",
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="TRIPS",
+        help="Use synthetic payloads with TRIPS trips per trip type instead of fixtures",
+    )
+    parser.add_argument("--vins", type=int, default=1, help="Number of cars (default: 1)")
+    parser.add_argument("--cycles", type=int, default=10, help="Measured cycles (default: 10)")
+    parser.add_argument("--warmup", type=int, default=1, help="Warm-up cycles (default: 1)")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Use trip state, so that only the first cycle exports trips",
+    )
+    parser.add_argument(
+        "--collector",
+        action="store_true",
+        help="Run cycles through a Collector with injected stand-ins",
+    )
+    parser.add_argument("--no-influx", action="store_true", help="Disable InfluxDB output")
+    parser.add_argument("--no-csv", action="store_true", help="Disable csv output")
+    parser.add_argument(
+        "--csv-fsync", default="cycle", choices=FSYNC_POLICIES, help="csv fsync policy"
+    )
+    parser.add_argument(
+        "--parquet", action="store_true", help="Enable Parquet output (requires pyarrow)"
+    )
+    parser.add_argument("--gzip", action="store_true", help="Compress InfluxDB write requests")
+    parser.add_argument(
+        "--batch-size", type=int, default=5000, help="InfluxSink batch size"
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="Report peak of Python allocations (slows down the benchmark)",
+    )
+    parser.add_argument(
+        "--serializer",
+        action="store_true",
+        help="Compare line protocol serialization of trips with influxdb_client Points",
+    )
+    parser.add_argument("--profile", action="store_true", help="Run under cProfile")
+    parser.add_argument(
+        "--profile-file",
+        help="Write the complete profile to this file for pstats or snakeviz (implies --profile)",
+    )
+    parser.add_argument("--json", help="Write results to JSON file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=10,
+        help="Allowed throughput drop against baseline in percent (default: 10)",
+    )
+    return parser.parse_args()
+
+
+def setUpWeConnect(args):
+    """
+    Register payloads for all cars and create Vehicle objects
+    """
+    weConnect = FakeWeConnect()
+    if args.synthetic is None:
+        status, trips = loadFixtures(args.fixtures or FIXTURES)
+    for n in range(args.vins):
+        vin = "WVWZZZBENCH%06d" % n
+        if args.synthetic is not None:
+            status = syntheticStatus(10000 + n, 50, 80)
+            trips = {
+                tripType: syntheticTrips(tripType, args.synthetic, n)
+                for tripType in TRIPTYPES
+            }
+        weConnect.addVehicle(vin, status, trips)
+    vehicles = [(vin, weConnect.vehicle(vin)) for vin in weConnect.status]
+    return weConnect, vehicles
+
+
+def runCycle(
+    vehicles, influxOut, csvOut, workDir, sink, csvSinks, extractor, tripState, parquetSinks
+):
+    """
+    One polling cycle as done by monitorVW
+    """
+    mTS = measurementTimestamp()
+    tripConf = {
+        "InfluxOutput": influxOut,
+        "csvOutput": csvOut,
+        "csvFile": os.path.join(workDir, "trips_{vin}.csv"),
+        "parquetOutput": parquetSinks is not None,
+    }
+    for vin, vehicle in vehicles:
+        vehicle.updateStatus(
+            updateCapabilities=False, force=True, selective=[Domain.MEASUREMENTS]
+        )
+        storeCarStatusData(
+            vehicle,
+            vin,
+            csvOut,
+            influxOut,
+            os.path.join(workDir, "status_" + vin + ".csv"),
+            sink,
+            ORG,
+            BUCKET,
+            csvSinks,
+            extractor,
+            timestamp=mTS,
+            parquetSinks=parquetSinks,
+        )
+        for key, tripType in TRIPDATA:
+            storeTripData(
+                vehicle,
+                vin,
+                tripType,
+                tripConf,
+                sink,
+                ORG,
+                TRIPBUCKET,
+                tripState,
+                None,
+                csvSinks,
+                parquetSinks=parquetSinks,
+            )
+    if sink:
+        sink.flush(wait=True)
+    csvSinks.sync()
+    if parquetSinks:
+        parquetSinks.sync()
+
+
+def setUpCollector(args, weConnect, workDir, writeAPI, csvSinks):
+    """
+    Create a Collector with injected stand-ins
+    """
+    influxOut = writeAPI is not None
+    csvOut = not args.no_csv
+    tripConf = {
+        "InfluxOutput": influxOut,
+        "csvOutput": csvOut,
+        "csvFile": os.path.join(workDir, "trips_{vin}.csv"),
+        "parquetOutput": args.parquet,
+    }
+    cfg = {
+        "InfluxOutput": influxOut,
+        "InfluxOrg": ORG,
+        "InfluxBucket": BUCKET,
+        "InfluxTripBucket": TRIPBUCKET,
+        "InfluxBatchSize": args.batch_size,
+        "InfluxSpool": False,
+        "csvOutput": csvOut,
+        "csvFile": os.path.join(workDir, "status_{vin}.csv"),
+        "parquetOutput": args.parquet,
+        "parquetDir": os.path.join(workDir, "parquet"),
+        "stateDir": workDir,
+        "weconRequestInterval": 0,
+        "carData": {key: tripConf for key, tripType in TRIPDATA},
+    }
+    collector = Collector(
+        cfg,
+        sessions=[FakeSession(weConnect)],
+        influxWriteAPI=writeAPI,
+        csvSinks=csvSinks,
+    )
+    collector.start()
+    return collector
+
+
+def runBenchmark(args):
+    """
+    Run warm-up and measured cycles and return results
+    """
+    workDir = tempfile.mkdtemp(prefix="monitorVW_benchmark_")
+    standIn = InfluxStandIn()
+    client = None
+    sink = None
+    influxOut = not args.no_influx
+    csvOut = not args.no_csv
+    writeAPI = None
+    if influxOut:
+        client = influxdb_client.InfluxDBClient(
+            url=standIn.url, token="benchmark", org=ORG, enable_gzip=args.gzip
+        )
+        writeAPI = client.write_api(write_options=SYNCHRONOUS)
+    csvSinks = CsvSinkPool(args.csv_fsync)
+    weConnect, vehicles = setUpWeConnect(args)
+    collector = None
+    parquetSinks = None
+    if args.collector:
+        collector = setUpCollector(args, weConnect, workDir, writeAPI, csvSinks)
+
+        def cycle():
+            collector.runOnce(waitForWrites=True)
+
+    else:
+        if influxOut:
+            sink = InfluxSink(writeAPI, ORG, batchSize=args.batch_size)
+        extractor = StatusExtractor()
+        tripState = None
+        if args.incremental:
+            tripState = TripState(os.path.join(workDir, "tripState.json"))
+        if args.parquet:
+            parquetSinks = ParquetSinkPool(os.path.join(workDir, "parquet"))
+        cycleArgs = (
+            vehicles, influxOut, csvOut, workDir, sink, csvSinks, extractor, tripState,
+            parquetSinks,
+        )
+
+        def cycle():
+            runCycle(*cycleArgs)
+
+    try:
+        for i in range(args.warmup):
+            cycle()
+
+        pointsBefore = standIn.points
+        bytesBefore = standIn.bytes
+        requestsBefore = weConnect.requests
+        profiler = cProfile.Profile() if args.profile or args.profile_file else None
+        if args.tracemalloc:
+            tracemalloc.start()
+        if profiler:
+            profiler.enable()
+        start = time.perf_counter()
+        for i in range(args.cycles):
+            cycle()
+        duration = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+        tracemallocPeak = None
+        if args.tracemalloc:
+            tracemallocPeak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        if collector:
+            collector.close()
+        csvSinks.close()
+        if parquetSinks:
+            parquetSinks.close()
+        if sink:
+            sink.close()
+        if client:
+            client.close()
+        standIn.close()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    points = standIn.points - pointsBefore
+    results = {
+        "vins": len(vehicles),
+        "cycles": args.cycles,
+        "seconds": round(duration, 3),
+        "cyclesPerSec": round(args.cycles / duration, 3),
+        "points": points,
+        "pointsPerSec": round(points / duration, 1),
+        "influxBytes": standIn.bytes - bytesBefore,
+        "weconRequests": weConnect.requests - requestsBefore,
+        "peakRssMB": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if tracemallocPeak is not None:
+        results["tracemallocPeakMB"] = round(tracemallocPeak / 1024 / 1024, 1)
+    if profiler:
+        pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(30)
+        if args.profile_file:
+            profiler.dump_stats(args.profile_file)
+    return results
+
+
+def pointLine(measurement, vin, trip):
+    """
+    Line protocol of a trip built through influxdb_client.Point
+    """
+    mileage = trip.mileage_km
+    return (
+        influxdb_client.Point(measurement)
+        .time(trip.tripEndTimestamp, influxdb_client.WritePrecision.MS)
+        .tag("vin", vin)
+        .tag("tripID", trip.id)
+        .tag("reportReason", "clamp15off")
+        .field("startMileage", trip.startMileage_km)
+        .field("tripMileage", mileage)
+        .field("traveltime", trip.travelTime)
+        .field("electricPowerConsumed", trip.averageElectricConsumption * mileage / 100)
+        .field("fuelConsumed", trip.averageFuelConsumption * mileage / 100)
+        .to_line_protocol()
+    )
+
+
+def runSerializerBenchmark(args):
+    """
+    Serialize trips through Points and through TripSerializer
+    """
+    count = args.synthetic or 5000
+    trips = parseTrips(syntheticTrips("shortTerm", count))
+    measurement = "trip_shortTerm"
+    vin = "WVWZZZBENCH000000"
+    results = {"trips": count, "cycles": args.cycles}
+    for key, serialize in (
+        ("pointLinesPerSec", lambda: [pointLine(measurement, vin, trip) for trip in trips]),
+        ("serializerLinesPerSec", lambda: TripSerializer(measurement).lines(vin, trips)),
+    ):
+        for i in range(args.warmup):
+            serialize()
+        start = time.perf_counter()
+        for i in range(args.cycles):
+            lines = serialize()
+        duration = time.perf_counter() - start
+        results[key] = round(count * args.cycles / duration, 1)
+        results[key.replace("LinesPerSec", "Bytes")] = len("\n".join(lines).encode())
+    if results["pointBytes"] != results["serializerBytes"] or lines != [
+        pointLine(measurement, vin, trip) for trip in trips
+    ]:
+        raise ValueError("Serializer output differs from Point output")
+    results["speedup"] = round(
+        results["serializerLinesPerSec"] / results["pointLinesPerSec"], 2
+    )
+    return results
+
+
+def compareBaseline(results, baselineFile, tolerance):
+    """
+    Compare throughput with a baseline; return list of regressions
+    """
+    with open(baselineFile, "r") as f:
+        baseline = json.load(f)
+    regressions = []
+    for key in ("cyclesPerSec", "pointsPerSec", "serializerLinesPerSec"):
+        if not baseline.get(key) or key not in results:
+            continue
+        change = (results[key] - baseline[key]) / baseline[key] * 100
+        print("%-14s %10s -> %10s (%+.1f%%)" % (key, baseline[key], results[key], change))
+        if change < -tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    args = getCl()
+    if args.serializer:
+        results = runSerializerBenchmark(args)
+    else:
+        results = runBenchmark(args)
+    for key, value in results.items():
+        print("%-18s %s" % (key, value))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        regressions = compareBaseline(results, args.baseline, args.tolerance)
+        if regressions:
+            print("Regression in " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Module standins
+
+Offline stand-ins for WeConnect and InfluxDB used by the benchmark.
+
+FakeWeConnect answers fetchData() requests of weconnect Vehicle objects and
+of fetchTripData() from recorded or synthetic JSON payloads.
+Payloads are kept as JSON text and parsed on every request,
+as the real client does with HTTP responses.
+
+FakeSession replaces WeConnectSession, so that a Collector can be run
+against FakeWeConnect.
+
+InfluxStandIn is a local HTTP server accepting InfluxDB v2 write requests.
+It counts the received points and discards them.
+"""
+
+import datetime
+import gzip
+import json
+import os
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from weconnect.addressable import AddressableDict
+from weconnect.domain import Domain
+from weconnect.elements.vehicle import Vehicle
+
+TRIPTYPES = ("shortTerm", "longTerm", "cyclic")
+
+TRIPURL = "https://emea.bff.cariad.digital/vehicle/v1/trips/"
+STATUSURL = "https://emea.bff.cariad.digital/vehicle/v1/vehicles/"
+
+
+class FakeWeConnect:
+    """
+    Serves recorded or synthetic WeConnect payloads per VIN
+    """
+
+    def __init__(self):
+        # vin -> JSON text of selectivestatus response
+        self.status = {}
+        # (vin, lower case trip type) -> JSON text of trip list
+        self.trips = {}
+        self.requests = 0
+        self.root = AddressableDict(localAddress="vehicles", parent=None)
+
+    def addVehicle(self, vin: str, status: dict, trips: dict):
+        """
+        Register payloads of one vehicle
+
+        status: selectivestatus response
+        trips:  trip type -> trip list response
+        """
+        self.status[vin] = json.dumps(status)
+        for tripType, data in trips.items():
+            self.trips[(vin, tripType.lower())] = json.dumps(data)
+
+    def vehicle(self, vin: str):
+        """
+        Create a weconnect Vehicle backed by this stand-in
+        """
+        return Vehicle(
+            self,
+            vin,
+            self.root,
+            {"vin": vin, "model": "Benchmark"},
+            updateCapabilities=False,
+            updatePictures=False,
+            selective=[Domain.MEASUREMENTS],
+        )
+
+    def fetchData(self, url, force=False, allowEmpty=False, allowHttpError=False, allowedErrors=None):
+        self.requests = self.requests + 1
+        if url.startswith(TRIPURL):
+            vin, tripType = url[len(TRIPURL) :].split("/")
+            text = self.trips.get((vin, tripType))
+            return json.loads(text) if text else None
+        if url.startswith(STATUSURL):
+            vin = url[len(STATUSURL) :].split("/")[0]
+            return json.loads(self.status[vin])
+        raise ValueError("Unexpected URL: " + url)
+
+
+class FakeSession:
+    """
+    Stand-in for WeConnectSession backed by FakeWeConnect
+    """
+
+    def __init__(self, weConnect: FakeWeConnect, username: str = "benchmark"):
+        self.weConnect = weConnect
+        self.username = username
+        self.requestedVins = list(weConnect.status)
+        self.loggedIn = False
+        self.fullLogin = False
+        self.fresh = False
+        self._vehicles = []
+
+    def tokensStored(self):
+        return False
+
+    def login(self):
+        self._vehicles = [(vin, self.weConnect.vehicle(vin)) for vin in self.requestedVins]
+        self.loggedIn = True
+        self.fullLogin = True
+        self.fresh = True
+
+    def renewTokens(self):
+        pass
+
+    def beginCycle(self):
+        self.fresh = False
+
+    def isFresh(self, domains: list = None):
+        return self.fresh
+
+    def refresh(self, domains: list = None):
+        for vin, vehicle in self._vehicles:
+            vehicle.updateStatus(
+                updateCapabilities=False, force=True, selective=[Domain.MEASUREMENTS]
+            )
+        self.fresh = True
+        return True
+
+    def vehicles(self):
+        return self._vehicles
+
+    def logout(self):
+        self._vehicles = []
+        self.loggedIn = False
+
+
+def loadFixtures(path: str):
+    """
+    Load recorded payloads from a directory
+
+    Expected files:
+    - measurements.json:      selectivestatus response
+    - trips_<tripType>.json:  trip list response per trip type (optional)
+    """
+    with open(os.path.join(path, "measurements.json"), "r") as f:
+        status = json.load(f)
+    trips = {}
+    for tripType in TRIPTYPES:
+        tripFile = os.path.join(path, "trips_" + tripType + ".json")
+        if os.path.exists(tripFile):
+            with open(tripFile, "r") as f:
+                trips[tripType] = json.load(f)
+    return status, trips
+
+
+def syntheticStatus(mileage: int, fuelLevel: int, soc: int):
+    """
+    Generate a selectivestatus response for the measurements domain
+    """
+    ts = datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {
+        "measurements": {
+            "odometerStatus": {
+                "value": {"carCapturedTimestamp": ts, "odometer": mileage}
+            },
+            "fuelLevelStatus": {
+                "value": {
+                    "carCapturedTimestamp": ts,
+                    "currentFuelLevel_pct": fuelLevel,
+                    "currentSOC_pct": soc,
+                    "primaryEngineType": "gasoline",
+                    "secondaryEngineType": "electric",
+                    "carType": "hybrid",
+                }
+            },
+        }
+    }
+
+
+def syntheticTrips(tripType: str, count: int, seed: int = 0):
+    """
+    Generate a trip list response with count consecutive trips
+    """
+    rnd = random.Random(seed)
+    end = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    mileage = 10000
+    data = []
+    for i in range(count):
+        tripMileage = rnd.randint(1, 120)
+        travelTime = max(1, tripMileage * rnd.randint(50, 120) // 60)
+        end = end + datetime.timedelta(minutes=travelTime + rnd.randint(30, 600))
+        data.append(
+            {
+                "id": str(seed * 1000000 + i + 1),
+                "tripEndTimestamp": end.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "tripType": tripType,
+                "vehicleType": "hybrid",
+                "mileage_km": tripMileage,
+                "startMileage_km": mileage,
+                "overallMileage_km": mileage + tripMileage,
+                "travelTime": travelTime,
+                "averageFuelConsumption": round(rnd.uniform(0, 8), 1),
+                "averageElectricConsumption": round(rnd.uniform(10, 25), 1),
+                "averageSpeed_kmph": tripMileage * 60 // travelTime,
+                "averageAuxConsumption": round(rnd.uniform(0, 2), 1),
+                "averageRecuperation": round(rnd.uniform(0, 5), 1),
+            }
+        )
+        mileage = mileage + tripMileage
+    return {"data": data}
+
+
+class InfluxStandIn:
+    """
+    Local HTTP server accepting InfluxDB v2 write requests
+    """
+
+    def __init__(self, address: str = "127.0.0.1"):
+        self.lock = threading.Lock()
+        self.points = 0
+        self.requests = 0
+        self.bytes = 0
+        standIn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(handler):
+                body = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+                if not handler.path.startswith("/api/v2/write"):
+                    handler.send_response(404)
+                    handler.send_header("Content-Length", "0")
+                    handler.end_headers()
+                    return
+                size = len(body)
+                if handler.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                points = sum(1 for line in body.split(b"\n") if line.strip())
+                with standIn.lock:
+                    standIn.points = standIn.points + points
+                    standIn.requests = standIn.requests + 1
+                    standIn.bytes = standIn.bytes + size
+                handler.send_response(204)
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://%s:%s" % (address, self.server.server_port)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="influxStandIn", daemon=True
+        )
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,7 @@
+"""
+Package monitorVW
+
+Collects car status and trip data from Volkswagen WeConnect.
+"""
+
+from .collector import Collector, CFGDEFAULTS
@@ -0,0 +1,143 @@
+"""
+Module archive
+
+Compressed archive of raw WeConnect data for offline reprocessing.
+
+Every record is stored as one JSON line with the fields
+- ts:       time of archiving (ISO, UTC)
+- kind:     "trips" (trip list response) or "status" (extracted car status)
+- vin:      VIN of the car
+- tripType: trip type (only for kind "trips")
+- data:     trip list response as returned by WeConnect, or
+            timestamp, tags and fields of the car status
+
+Records are appended to gzip files partitioned by day (UTC):
+
+    <archiveDir>/<YYYY-MM>/raw_<YYYY-MM-DD>.jsonl.gz
+
+Records of a cycle are written as one gzip member, which is completed by sync().
+A file can therefore be read with any gzip tool; if monitorVW was
+interrupted while writing, only the incomplete last member is lost.
+"""
+
+import datetime
+import gzip
+import json
+import os
+import threading
+import zlib
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+STATUS = "status"
+TRIPS = "trips"
+
+FILEPREFIX = "raw_"
+FILESUFFIX = ".jsonl.gz"
+
+
+class RawArchive:
+    """
+    Append-only archive of raw payloads in daily gzip files
+    """
+
+    def __init__(self, directory: str, compressLevel: int = 6):
+        """
+        directory:     root directory of the archive
+        compressLevel: gzip compression level (1-9)
+        """
+        self.directory = directory
+        self.compressLevel = compressLevel
+        self.lock = threading.Lock()
+        self.f = None
+        self.path = None
+
+    def _pathFor(self, day: datetime.date):
+        return os.path.join(
+            self.directory,
+            day.strftime("%Y-%m"),
+            FILEPREFIX + day.isoformat() + FILESUFFIX,
+        )
+
+    def append(self, kind: str, vin: str, data, tripType: str = None):
+        """
+        Append one record
+        """
+        self.extend([(kind, vin, data, tripType)])
+
+    def extend(self, records):
+        """
+        Append records (kind, vin, data, tripType) with one write
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        lines = []
+        for kind, vin, data, tripType in records:
+            record = {"ts": now.isoformat(), "kind": kind, "vin": vin}
+            if tripType is not None:
+                record["tripType"] = tripType
+            record["data"] = data
+            lines.append(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+        path = self._pathFor(now.date())
+        with self.lock:
+            if path != self.path:
+                self._close()
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.f = gzip.open(path, "at", compresslevel=self.compressLevel)
+                self.path = path
+            self.f.write("".join(lines))
+
+    def _close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            self.path = None
+
+    def sync(self):
+        """
+        Complete the current gzip member (end of cycle)
+        """
+        with self.lock:
+            self._close()
+
+    def close(self):
+        """
+        Close the archive
+        """
+        self.sync()
+
+    def files(self, since: datetime.date = None):
+        """
+        Archive files in chronological order, optionally starting at a day
+        """
+        files = []
+        if not os.path.isdir(self.directory):
+            return files
+        for month in sorted(os.listdir(self.directory)):
+            monthDir = os.path.join(self.directory, month)
+            if not os.path.isdir(monthDir):
+                continue
+            for name in sorted(os.listdir(monthDir)):
+                if not (name.startswith(FILEPREFIX) and name.endswith(FILESUFFIX)):
+                    continue
+                day = name[len(FILEPREFIX) : -len(FILESUFFIX)]
+                if since is not None and day < since.isoformat():
+                    continue
+                files.append(os.path.join(monthDir, name))
+        return files
+
+    def records(self, since: datetime.date = None):
+        """
+        Iterate over all records in chronological order
+        """
+        for path in self.files(since):
+            logger.debug("Reading archive file %s", path)
+            try:
+                with gzip.open(path, "rt") as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            logger.warning("Invalid record in %s skipped", path)
+            except (EOFError, gzip.BadGzipFile, zlib.error) as error:
+                logger.warning("Archive file %s is truncated: %s", path, error)
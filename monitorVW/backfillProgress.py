@@ -0,0 +1,80 @@
+"""
+Module backfillProgress
+
+Progress of a historical trip backfill.
+
+For every VIN and trip type, the IDs of trips already loaded and a completion
+flag are persisted, so that an interrupted backfill can be resumed
+without loading trips twice.
+"""
+
+import json
+import os
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+
+class BackfillProgress:
+    """
+    Persistent backfill progress per VIN and trip type
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.progress = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.progress = json.load(f)
+            logger.info("Resuming backfill from %s", path)
+
+    def _entry(self, vin: str, tripType: str):
+        return self.progress.setdefault(vin, {}).setdefault(
+            tripType, {"done": False, "ids": []}
+        )
+
+    def isDone(self, vin: str, tripType: str):
+        """
+        Check whether backfill is complete for VIN and trip type
+        """
+        return self.progress.get(vin, {}).get(tripType, {}).get("done", False)
+
+    def loaded(self, vin: str, tripType: str):
+        """
+        Return set of IDs of trips already loaded
+        """
+        return set(self.progress.get(vin, {}).get(tripType, {}).get("ids", []))
+
+    def addLoaded(self, vin: str, tripType: str, ids):
+        """
+        Register trips as loaded
+        """
+        entry = self._entry(vin, tripType)
+        entry["ids"].extend(ids)
+        self.save()
+
+    def setDone(self, vin: str, tripType: str):
+        """
+        Mark backfill as complete for VIN and trip type
+        """
+        entry = self._entry(vin, tripType)
+        entry["done"] = True
+        entry["ids"] = []
+        self.save()
+
+    def save(self):
+        """
+        Persist progress atomically
+        """
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(self.progress, f)
+        os.replace(tmpPath, self.path)
+
+    def remove(self):
+        """
+        Delete progress file after a completed backfill
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.progress = {}
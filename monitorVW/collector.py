@@ -0,0 +1,916 @@
+"""
+Module collector
+
+Collector for car status and trip data of one or more WeConnect accounts.
+
+A Collector holds all runtime state (sessions, sinks, caches, scheduler)
+and can be embedded in other applications:
+
+    collector = Collector(cfg)
+    collector.start()       # set up sinks and sessions
+    collector.runOnce()     # one polling cycle, e.g. under an own scheduler
+    collector.run()         # or: poll until stop() is called
+    collector.replay()      # or: export the raw data archive again
+    collector.close()       # log out and release sinks
+
+Backends can be injected for testing or embedding:
+- sessions:       objects with the interface of WeConnectSession
+- influxWriteAPI: object with the write() method of influxdb_client WriteApi
+- csvSinks:       CsvSinkPool
+- fetchTrips:     function (vehicle, tripType) -> raw trip data
+- metrics, tracer
+"""
+
+import copy
+import datetime
+import hashlib
+import os
+import threading
+import time
+import influxdb_client
+from influxdb_client.client.write_api import SYNCHRONOUS
+from weconnect.domain import Domain
+from weconnect.errors import (
+    APICompatibilityError,
+    AuthentificationError,
+    TooManyRequestsError,
+)
+import logging_plus
+from .archive import STATUS, TRIPS, RawArchive
+from .backfillProgress import BackfillProgress
+from .csvSink import CsvSinkPool
+from .export import (
+    TRIPDATA,
+    VEHICLEMETRICS,
+    backfillTrips,
+    csvPathForVin,
+    measurementTimestamp,
+    prefetchTripData,
+    storeCarStatusData,
+    storeTripData,
+    tripOutputRequired,
+    writeCarStatus,
+)
+from .fetchPool import FetchPool
+from .influxSink import InfluxSink
+from .metrics import Metrics, MetricsServer
+from .parquetSink import ParquetSinkPool
+from .requestBudget import RequestBudget, LOGINREQUESTS
+from .scheduler import AdaptiveInterval, CycleScheduler
+from .spool import Spool
+from .stages import AUTH, FATAL, QUOTA, Stages, classifyError
+from .statusDedup import StatusDedup
+from .statusMapping import StatusExtractor, STATUSFIELDS
+from .tracing import Tracer
+from .tripAggregation import AGGREGATEDTYPES, TripAggregator
+from .tripCache import TripCache
+from .tripRecord import parseTrips
+from .tripState import TripState
+from .weconSession import WeConnectSession
+
+logger = logging_plus.getLogger("main")
+
+# Configuration defaults
+CFGDEFAULTS = {
+    "measurementInterval": 1800,
+    "adaptiveInterval": False,
+    "minInterval": 300,
+    "maxInterval": 7200,
+    "intervalBackoffFactor": 2,
+    "catchUpPolicy": "skip",
+    "cycleJitter": 0,
+    "weconUsername": None,
+    "weconPassword": None,
+    "weconSPin": None,
+    "weconCarId": None,
+    "accounts": [],
+    "InfluxOutput": False,
+    "InfluxURL": None,
+    "InfluxOrg": None,
+    "InfluxToken": None,
+    "InfluxBucket": None,
+    "InfluxTripBucket": None,
+    "InfluxBatchSize": 5000,
+    "InfluxFlushInterval": 10000,
+    "InfluxMaxRetries": 5,
+    "InfluxRetryInterval": 5000,
+    "InfluxSpool": True,
+    "InfluxGzip": False,
+    "InfluxPoolSize": 2,
+    "InfluxConnectTimeout": 10000,
+    "InfluxWriteTimeout": 30000,
+    "csvOutput": False,
+    "csvFile": "",
+    "csvFsync": "cycle",
+    "csvMaxBytes": 0,
+    "csvRotateDays": 0,
+    "parquetOutput": False,
+    "parquetDir": "",
+    "parquetCompression": "zstd",
+    "parquetRowGroupSize": 10000,
+    "parquetFlushInterval": 0,
+    "parquetMaxParts": 48,
+    "stateDir": "",
+    "weconMaxConcurrency": 3,
+    "weconRequestInterval": 500,
+    "weconDailyRequestLimit": 0,
+    "weconTripRequestReserve": 20,
+    "weconTokenStore": True,
+    "weconTokenRenewMargin": 300,
+    "weconDomains": ["measurements"],
+    "statusFields": STATUSFIELDS,
+    "statusDedup": False,
+    "statusHeartbeat": 3600,
+    "metricsPort": 0,
+    "metricsAddress": "",
+    "traceSpans": False,
+    "traceFile": "",
+    "tripAggregation": False,
+    "refuelThreshold": 10,
+    "stageRetries": 2,
+    "stageRetryDelay": 5,
+    "rawArchive": False,
+    "rawArchiveDir": "",
+    "carData": [],
+}
+
+# Files in stateDir
+TRIPSTATEFILENAME = "monitorVW_tripState.json"
+SPOOLFILENAME = "monitorVW_spool.db"
+BUDGETFILENAME = "monitorVW_requestBudget.json"
+BACKFILLFILENAME = "monitorVW_backfill.json"
+TOKENFILEPREFIX = "monitorVW_tokens_"
+DEDUPFILENAME = "monitorVW_statusDedup.json"
+AGGREGATIONFILENAME = "monitorVW_tripAggregation.json"
+ARCHIVEDIRNAME = "archive"
+
+# Max. number of consecutive unexpected exceptions before run() gives up
+MAXEXCEPTIONS = 10
+# Max. number of consecutive failed logins before run() gives up
+MAXLOGINFAILURES = 10
+# Max. age (sec) of the checkpoint of a failed cycle for resuming it
+CHECKPOINTMAXAGE = 300
+
+
+class Collector:
+    """
+    Polls WeConnect and exports car status and trip data
+    """
+
+    def __init__(
+        self,
+        cfg: dict,
+        sessions: list = None,
+        influxWriteAPI=None,
+        csvSinks: CsvSinkPool = None,
+        metrics: Metrics = None,
+        tracer: Tracer = None,
+        fetchTrips=None,
+    ):
+        """
+        cfg:            configuration; missing keys are taken from CFGDEFAULTS
+        sessions:       WeConnect sessions (default: one per account in cfg)
+        influxWriteAPI: synchronous write API (default: InfluxDBClient from cfg)
+        csvSinks:       csv sinks (default: CsvSinkPool from cfg)
+        metrics:        metrics registry (default: new registry)
+        tracer:         tracer for timing spans (default: from cfg)
+        fetchTrips:     source of raw trip data (default: fetchTripData)
+        """
+        self.cfg = copy.deepcopy(CFGDEFAULTS)
+        self.cfg.update(cfg)
+        if not self.cfg["stateDir"]:
+            self.cfg["stateDir"] = os.getcwd()
+        self.sessions = sessions
+        self.influxWriteAPI = influxWriteAPI
+        self.csvSinks = csvSinks
+        self.metrics = metrics
+        self.tracer = tracer
+        self.ownTracer = tracer is None
+        self.fetchTrips = fetchTrips
+
+        self.stopEvent = threading.Event()
+        self.started = False
+        self.cycles = 0
+        self.session = None
+        self.influxClient = None
+        self.influxSink = None
+        self.metricsServer = None
+        self.parquetSinks = None
+        self.archive = None
+        self.tripState = None
+        self.tripAggregator = None
+        self.stages = None
+        self.nextInterval = None
+
+    def start(self):
+        """
+        Set up sinks, state and sessions
+
+        Login to WeConnect is done in the first cycle.
+        """
+        if self.started:
+            return
+        cfg = self.cfg
+        self.stopEvent.clear()
+
+        # Timing spans
+        if self.tracer is None:
+            self.tracer = Tracer(cfg["traceSpans"], cfg["traceFile"] or None)
+
+        # Columnar output; fails early if pyarrow is missing
+        if cfg["parquetOutput"]:
+            self.parquetSinks = ParquetSinkPool(
+                cfg["parquetDir"],
+                cfg["parquetCompression"],
+                cfg["parquetRowGroupSize"],
+                cfg["parquetFlushInterval"],
+                cfg["parquetMaxParts"],
+            )
+
+        # Archive of raw data for replay
+        if cfg["rawArchive"]:
+            self.archive = RawArchive(self.archiveDir())
+
+        # Metrics endpoint
+        if self.metrics is None:
+            self.metrics = Metrics()
+        if cfg["metricsPort"]:
+            self.metricsServer = MetricsServer(
+                self.metrics, cfg["metricsPort"], cfg["metricsAddress"]
+            )
+
+        try:
+            # Instatntiate InfluxDB access
+            if cfg["InfluxOutput"]:
+                if self.influxWriteAPI is None:
+                    self.influxClient = influxdb_client.InfluxDBClient(
+                        url=cfg["InfluxURL"],
+                        token=cfg["InfluxToken"],
+                        org=cfg["InfluxOrg"],
+                        timeout=(cfg["InfluxConnectTimeout"], cfg["InfluxWriteTimeout"]),
+                        enable_gzip=cfg["InfluxGzip"],
+                        connection_pool_maxsize=cfg["InfluxPoolSize"],
+                    )
+                    self.influxWriteAPI = self.influxClient.write_api(
+                        write_options=SYNCHRONOUS
+                    )
+                influxQueue = None
+                if cfg["InfluxSpool"]:
+                    # Durable write-ahead buffer for InfluxDB outages
+                    influxQueue = Spool(os.path.join(cfg["stateDir"], SPOOLFILENAME))
+                self.influxSink = InfluxSink(
+                    self.influxWriteAPI,
+                    cfg["InfluxOrg"],
+                    batchSize=cfg["InfluxBatchSize"],
+                    flushInterval=cfg["InfluxFlushInterval"],
+                    maxRetries=cfg["InfluxMaxRetries"],
+                    retryInterval=cfg["InfluxRetryInterval"],
+                    queue=influxQueue,
+                    metrics=self.metrics,
+                    tracer=self.tracer,
+                )
+                logger.debug("Influx interface instantiated")
+        except Exception as error:
+            logger.critical("Unexpected Exception (%s): %s", error.__class__, error)
+            logger.critical("Could not get InfluxDB access")
+            self._closeSinks()
+            raise
+
+        # Restore high-water-mark of exported trips
+        self.tripState = TripState(os.path.join(cfg["stateDir"], TRIPSTATEFILENAME))
+        if cfg["tripAggregation"]:
+            self.tripAggregator = TripAggregator(
+                os.path.join(cfg["stateDir"], AGGREGATIONFILENAME), cfg["refuelThreshold"]
+            )
+
+        if self.sessions is None:
+            self.sessions = [
+                WeConnectSession(
+                    account,
+                    self.tokenFile(account),
+                    cfg["weconTokenRenewMargin"],
+                    [Domain(domain) for domain in cfg["weconDomains"]],
+                )
+                for account in cfg["accounts"]
+            ]
+        self.fetchPool = FetchPool(cfg["weconMaxConcurrency"], cfg["weconRequestInterval"])
+        self.tripCache = TripCache()
+        self.statusExtractor = StatusExtractor(cfg["statusFields"])
+        self.statusDedup = None
+        if cfg["statusDedup"]:
+            self.statusDedup = StatusDedup(
+                os.path.join(cfg["stateDir"], DEDUPFILENAME), cfg["statusHeartbeat"]
+            )
+        if self.csvSinks is None:
+            self.csvSinks = CsvSinkPool(
+                cfg["csvFsync"], cfg["csvMaxBytes"], cfg["csvRotateDays"]
+            )
+        self.requestBudget = RequestBudget(
+            os.path.join(cfg["stateDir"], BUDGETFILENAME),
+            cfg["weconDailyRequestLimit"],
+            cfg["weconTripRequestReserve"],
+        )
+        self.cycleScheduler = CycleScheduler(
+            cfg["measurementInterval"],
+            cfg["catchUpPolicy"],
+            cfg["cycleJitter"],
+            self.stopEvent,
+        )
+        self.stages = Stages(
+            cfg["stageRetries"], cfg["stageRetryDelay"], self.stopEvent, self.metrics
+        )
+        self.adaptiveInterval = None
+        if cfg["adaptiveInterval"]:
+            self.adaptiveInterval = AdaptiveInterval(
+                cfg["minInterval"], cfg["maxInterval"], cfg["intervalBackoffFactor"]
+            )
+        self.started = True
+
+    def tokenFile(self, account: dict):
+        """
+        Path of the token file for an account (None if tokens are not stored)
+        """
+        if not self.cfg["weconTokenStore"]:
+            return None
+        userHash = hashlib.sha1(account["weconUsername"].encode("utf-8")).hexdigest()
+        return os.path.join(
+            self.cfg["stateDir"], TOKENFILEPREFIX + userHash[:12] + ".json"
+        )
+
+    def archiveDir(self):
+        """
+        Root directory of the raw data archive
+        """
+        return self.cfg["rawArchiveDir"] or os.path.join(
+            self.cfg["stateDir"], ARCHIVEDIRNAME
+        )
+
+    def runOnce(self, waitForWrites: bool = False):
+        """
+        Run one polling cycle for all accounts
+
+        waitForWrites: wait until InfluxDB has accepted all points of the cycle
+        Failed stages are retried according to their retry policy.
+        Remaining exceptions are raised to the caller. The stages completed so far
+        are kept, so that they are skipped when runOnce() is called again within
+        CHECKPOINTMAXAGE seconds; later calls start a new cycle (see resetCycle()).
+        Trip types which cannot be fetched are skipped; authentication, quota and
+        API errors of trip requests are raised after the cycle has been completed.
+        Returns dict vin -> (mileage, fuelLevel, stateOfCharge)
+        """
+        self.start()
+        cfg = self.cfg
+        metrics = self.metrics
+        tracer = self.tracer
+        stages = self.stages
+
+        logger.debug("monitorVW - cycle started")
+        if stages.completed and stages.age() > CHECKPOINTMAXAGE:
+            logger.info("Checkpoint of failed cycle expired. Starting a new cycle")
+            stages.reset()
+        if stages.completed:
+            logger.info("Resuming cycle with %s completed stages", len(stages.completed))
+        cycleStart = time.perf_counter()
+        cycleTs = time.time()
+        tracer.beginCycle()
+        mTS = measurementTimestamp()
+        activity = {}
+        fetchFailures = {}
+
+        for session in self.sessions:
+            self.session = session
+            account = session.username
+
+            # Log in and update all cars of the account
+            if not stages.run(("refresh", account), self._refresh, session):
+                continue
+
+            # Fetch trip data of all cars of the account concurrently.
+            # Requests are retried individually, so that the stage itself is not
+            # retried; failed trip types are skipped in this cycle.
+            cfgc = cfg.get("carData") or {}
+            tripData, failures = stages.run(
+                ("prefetchTrips", account),
+                prefetchTripData,
+                self.fetchPool,
+                session.vehicles(),
+                cfgc,
+                account,
+                self.requestBudget,
+                self.tripCache,
+                metrics,
+                tracer,
+                self.fetchTrips,
+                stages,
+                self.tripAggregator is not None,
+            )
+            for error in failures.values():
+                fetchFailures.setdefault(classifyError(error), (session, error))
+
+            for theVin, vehicle in session.vehicles():
+                # Store car data
+                logger.debug("storing car measurement data for %s", theVin)
+                activity[theVin] = stages.run(
+                    ("status", theVin),
+                    storeCarStatusData,
+                    vehicle,
+                    theVin,
+                    cfg["csvOutput"],
+                    cfg["InfluxOutput"],
+                    csvPathForVin(cfg["csvFile"], theVin),
+                    self.influxSink,
+                    cfg["InfluxOrg"],
+                    cfg["InfluxBucket"],
+                    self.csvSinks,
+                    self.statusExtractor,
+                    self.statusDedup,
+                    tracer,
+                    mTS,
+                    self.parquetSinks,
+                )
+                if self.archive:
+                    stages.run(
+                        ("archive", theVin),
+                        self._archive,
+                        vehicle,
+                        theVin,
+                        mTS,
+                        tripData,
+                    )
+                for name, value in zip(VEHICLEMETRICS, activity[theVin]):
+                    metrics.set(name, value, vin=theVin)
+
+                # Store trip data
+                for key, tripType in TRIPDATA:
+                    if (theVin, key) in tripData and self._tripOutput(key):
+                        stages.run(
+                            ("trips", theVin, key),
+                            self._storeTrips,
+                            vehicle,
+                            theVin,
+                            key,
+                            tripType,
+                            tripData[(theVin, key)],
+                        )
+
+                # Build long-term and cyclic trips from short-term trips
+                if self.tripAggregator:
+                    self.tripAggregator.observeStatus(
+                        theVin, activity[theVin][0], activity[theVin][1]
+                    )
+                    aggregates = stages.run(
+                        ("aggregateTrips", theVin), self._aggregateTrips, theVin, tripData
+                    )
+                    for key, tripType in TRIPDATA:
+                        if aggregates.get(tripType.value) and self._tripOutput(key):
+                            stages.run(
+                                ("trips", theVin, key),
+                                self._storeTrips,
+                                vehicle,
+                                theVin,
+                                key,
+                                tripType,
+                                None,
+                                aggregates[tripType.value],
+                            )
+
+                for key, tripType in TRIPDATA:
+                    if (theVin, key) in tripData:
+                        self.tripCache.commit(theVin, key, tripData[(theVin, key)])
+        self.session = None
+
+        # Send all points of this cycle in one batch per bucket
+        if self.influxSink:
+            with tracer.span("influxFlush"):
+                stages.run(("influxFlush",), self.influxSink.flush, waitForWrites)
+            metrics.set("influx_pending_points", self.influxSink.pendingCount)
+
+        # Flush csv files according to fsync policy
+        with tracer.span("csvSync"):
+            stages.run(("csvSync",), self.csvSinks.sync)
+        if self.parquetSinks:
+            with tracer.span("parquetSync"):
+                stages.run(("parquetSync",), self.parquetSinks.sync)
+        if self.archive:
+            stages.run(("archiveSync",), self.archive.sync)
+        stages.reset()
+
+        # Adapt measurement interval to vehicle activity
+        if self.adaptiveInterval:
+            self.nextInterval = self.adaptiveInterval.observe(activity)
+
+        cycleDuration = time.perf_counter() - cycleStart
+        metrics.observe("cycle_duration_seconds", cycleDuration)
+        metrics.set("last_cycle_timestamp_seconds", time.time())
+        tracer.record("cycle", cycleTs, cycleDuration)
+        self.cycles = self.cycles + 1
+        logger.debug("monitorVW - cycle completed")
+
+        # Failed trip requests requiring a new login or a pause are raised
+        # after the data of all cars have been stored
+        for errorClass in (FATAL, QUOTA, AUTH):
+            if errorClass in fetchFailures:
+                self.session, error = fetchFailures[errorClass]
+                raise error
+        return activity
+
+    def resetCycle(self):
+        """
+        Discard the checkpoint of a failed cycle
+
+        The next runOnce() then polls WeConnect again for all cars instead of
+        resuming the failed cycle. Call this when runOnce() is not repeated
+        immediately after a failure, e.g. when the next call is at the next
+        scheduled slot.
+        """
+        if self.stages:
+            self.stages.reset()
+
+    def _refresh(self, session):
+        """
+        Log in if required and update all cars of a session
+
+        Returns False if the request budget of the account is exhausted.
+        """
+        account = session.username
+        requestBudget = self.requestBudget
+        tracer = self.tracer
+        # Requests for an update: vehicle list + one per vehicle
+        updateRequests = 1 + len(session.requestedVins)
+        session.beginCycle()
+
+        # Log in to WE Connect
+        # Login requests are only charged if stored tokens cannot be reused
+        if not session.loggedIn:
+            loginRequests = 0 if session.tokensStored() else LOGINREQUESTS
+            if not requestBudget.allows(account, loginRequests + updateRequests):
+                logger.warning("Request budget of %s exhausted", account)
+                return False
+            logger.debug("Login to WeConnect required for %s", account)
+
+            def login():
+                requestBudget.consume(account, updateRequests)
+                try:
+                    session.login()
+                finally:
+                    if session.fullLogin:
+                        requestBudget.consume(account, LOGINREQUESTS)
+
+            with tracer.span("login", account=account):
+                self.stages.retrying(login, "login")()
+            logger.debug("Login successful")
+        else:
+            session.renewTokens()
+
+        # Update all cars of the account unless already done during login
+        if not session.isFresh():
+            if not requestBudget.allows(account, updateRequests):
+                logger.warning("Request budget of %s exhausted", account)
+                return False
+            logger.debug("getting measurements")
+
+            def update():
+                requestBudget.consume(account, updateRequests)
+                return self.metrics.timed(session.refresh, "wecon_update_seconds")()
+
+            with tracer.span("update", account=account):
+                self.stages.retrying(update, "update")()
+            logger.debug("got measurements")
+        return True
+
+    def _tripOutput(self, key: str):
+        """
+        Check whether output is configured for a carData section
+        """
+        cfgc = self.cfg.get("carData") or {}
+        return key in cfgc and tripOutputRequired(cfgc[key])
+
+    def _archive(self, vehicle, vin: str, timestamp: str, tripData: dict):
+        """
+        Append the status and the changed trip lists of a car to the archive
+
+        All records of the car are written at once, so that retrying the stage
+        after a failed write does not archive records twice.
+        """
+        fields, tags = self.statusExtractor.extract(vehicle)
+        records = [
+            (STATUS, vin, {"timestamp": timestamp, "tags": tags, "fields": fields}, None)
+        ]
+        for key, tripType in TRIPDATA:
+            if (vin, key) in tripData:
+                records.append((TRIPS, vin, tripData[(vin, key)], key))
+        self.archive.extend(records)
+
+    def _aggregateTrips(self, vin: str, tripData: dict):
+        """
+        Add new short-term trips of a car to the local aggregates
+
+        Returns dict trip type value -> updated aggregates
+        """
+        for key, tripType in TRIPDATA:
+            if tripType in AGGREGATEDTYPES:
+                continue
+            if (vin, key) in tripData:
+                return self.tripAggregator.addTrips(vin, parseTrips(tripData[(vin, key)]))
+        return {}
+
+    def _storeTrips(self, vehicle, vin: str, key: str, tripType, data, trips: list = None):
+        """
+        Store prefetched trip data or TripRecords of one car and trip type
+        """
+        logger.debug("storing trip data %s", tripType.value)
+        storeTripData(
+            vehicle,
+            vin,
+            tripType,
+            self.cfg["carData"][key],
+            self.influxSink,
+            self.cfg["InfluxOrg"],
+            self.cfg["InfluxTripBucket"],
+            self.tripState,
+            data,
+            self.csvSinks,
+            self.tracer,
+            self.parquetSinks,
+            trips,
+        )
+
+    def run(self, maxCycles: int = 0, noWait: bool = False):
+        """
+        Poll WeConnect in scheduled cycles until stop() is called
+
+        maxCycles: stop after this number of cycles (0: no limit)
+        noWait:    start cycles immediately instead of waiting for the next slot;
+                   points are then written before the next cycle starts
+        """
+        self.start()
+        waitNext = not noWait
+        waitUntilMidnight = False
+        failcount = 0
+        exceptioncount = 0
+        cycles = 0
+        metrics = self.metrics
+
+        while not self.stopEvent.is_set():
+            try:
+                # Wait unless waitNext is reset in case of VWError.
+                if waitNext:
+                    # A new regular cycle starts from scratch
+                    self.stages.reset()
+                    if waitUntilMidnight:
+                        self.cycleScheduler.waitUntilMidnight()
+                    else:
+                        self.cycleScheduler.waitForNextSlot(self.nextInterval)
+                    if self.stopEvent.is_set():
+                        break
+                waitNext = not noWait
+                waitUntilMidnight = False
+
+                self.runOnce(waitForWrites=noWait)
+                cycles = cycles + 1
+                if maxCycles and cycles >= maxCycles:
+                    self.stopEvent.set()
+
+                exceptioncount = 0
+
+            except AuthentificationError as error:
+                metrics.inc("exceptions_total", type="AuthentificationError")
+                session = self.session
+                self.session = None
+                self.stages.reset()
+                if session and session.loggedIn:
+                    # if already logged in to WEConnect, it may be possible that the automatic forced login
+                    # was not successful. Therefore re-instantiate vwc and try again without waiting
+                    logger.error("Unexpected AuthentificationError: %s", error)
+                    logger.error("Trying to immediately re-instantiate WE Connect handle vwc")
+                    session.logout()
+                    waitNext = False
+                else:
+                    # exception occured during login
+                    # wait a cycle an try again
+                    logger.error("Unexpected AuthentificationError: %s", error)
+                    logger.error(
+                        "Trying to re-instantiate WE Connect handle vwc in next cycle"
+                    )
+                    if session:
+                        session.logout()
+                    waitNext = not noWait
+                    failcount = failcount + 1
+                    if failcount > MAXLOGINFAILURES:
+                        self.stopEvent.set()
+                        logger.critical(
+                            "Could not establish connection to WE Connect after %s tries",
+                            failcount,
+                        )
+                        logger.critical("Stopping")
+
+            except TooManyRequestsError as error:
+                metrics.inc("exceptions_total", type="TooManyRequestsError")
+                logger.error("Too many requests from your account. Retrying after midnight.")
+                session = self.session
+                self.session = None
+                self.stages.reset()
+                if session:
+                    self.requestBudget.exhaust(session.username)
+                if session and session.loggedIn:
+                    # if already logged in to WEConnect, logg off and force new login
+                    session.logout()
+
+                # In case of too many requests wait until midnight
+                waitNext = not noWait
+                waitUntilMidnight = True
+
+            except APICompatibilityError as error:
+                metrics.inc("exceptions_total", type="APICompatibilityError")
+                logger.critical("Unexpected APICompatibilityError: %s", error)
+                self.close()
+                raise error
+
+            except Exception as error:
+                metrics.inc("exceptions_total", type=error.__class__.__name__)
+                self.session = None
+                exceptioncount = exceptioncount + 1
+                if exceptioncount <= MAXEXCEPTIONS:
+                    # The cycle is resumed after the last completed stage
+                    logger.error(
+                        "Unexpected Exception (%s, %s error): %s",
+                        error.__class__,
+                        classifyError(error) or "unexpected",
+                        error,
+                    )
+                    waitNext = False
+                    waitUntilMidnight = False
+                    self.stopEvent.wait(10)
+                else:
+                    logger.critical("Unexpected Exception: %s", error)
+                    self.close()
+                    raise error
+
+            except KeyboardInterrupt:
+                self.stopEvent.set()
+                logger.debug("KeyboardInterrupt")
+
+    def backfill(self):
+        """
+        Load all available trips into InfluxDB
+
+        Returns True if the backfill has been completed, False if it has been
+        stopped because the request budget is exhausted.
+        """
+        if not self.cfg["InfluxOutput"]:
+            raise ValueError("Backfill requires InfluxOutput")
+        self.start()
+        return backfillTrips(
+            self.sessions,
+            self.cfg.get("carData") or {},
+            self.influxSink,
+            self.cfg["InfluxOrg"],
+            self.cfg["InfluxTripBucket"],
+            self.tripState,
+            BackfillProgress(os.path.join(self.cfg["stateDir"], BACKFILLFILENAME)),
+            self.cfg["InfluxBatchSize"],
+            self.requestBudget,
+        )
+
+    def replay(self, since: datetime.date = None):
+        """
+        Export the archived raw data again, without access to WeConnect
+
+        since: first day to be replayed (default: complete archive)
+        Records are processed in the order in which they were archived, through
+        the same functions as in a polling cycle. Trips are deduplicated in memory,
+        independent of the trip state of the regular service, and all trips are
+        exported regardless of InfluxTimeStart and InfluxDaysBefore.
+        Local aggregates are rebuilt from scratch if tripAggregation is configured.
+        Returns dict record kind -> number of replayed records
+        """
+        self.start()
+        cfg = self.cfg
+        archive = RawArchive(self.archiveDir())
+        cfgc = copy.deepcopy(cfg.get("carData") or {})
+        for conf in cfgc.values():
+            conf["InfluxTimeStart"] = ""
+            conf["InfluxDaysBefore"] = ""
+        tripTypes = dict(TRIPDATA)
+        tripState = TripState(None)
+        tripAggregator = None
+        if cfg["tripAggregation"]:
+            tripAggregator = TripAggregator(None, cfg["refuelThreshold"])
+        counts = {STATUS: 0, TRIPS: 0}
+
+        def storeTrips(vin, key, data, trips=None):
+            if key in cfgc and tripOutputRequired(cfgc[key]):
+                storeTripData(
+                    None,
+                    vin,
+                    tripTypes[key],
+                    cfgc[key],
+                    self.influxSink,
+                    cfg["InfluxOrg"],
+                    cfg["InfluxTripBucket"],
+                    tripState,
+                    data,
+                    self.csvSinks,
+                    self.tracer,
+                    self.parquetSinks,
+                    trips,
+                )
+
+        logger.info("Replay of archive %s started", archive.directory)
+        for record in archive.records(since):
+            if self.stopEvent.is_set():
+                break
+            vin = record["vin"]
+            data = record["data"]
+            if record["kind"] == STATUS:
+                writeCarStatus(
+                    vin,
+                    data["tags"],
+                    data["fields"],
+                    data["timestamp"],
+                    cfg["csvOutput"],
+                    cfg["InfluxOutput"],
+                    csvPathForVin(cfg["csvFile"], vin),
+                    self.influxSink,
+                    cfg["InfluxOrg"],
+                    cfg["InfluxBucket"],
+                    self.csvSinks,
+                    self.tracer,
+                    self.parquetSinks,
+                )
+                if tripAggregator:
+                    fields = data["fields"]
+                    tripAggregator.observeStatus(
+                        vin, fields.get("mileage"), fields.get("fuelLevel")
+                    )
+            elif record["kind"] == TRIPS:
+                key = record.get("tripType")
+                if key not in tripTypes:
+                    continue
+                if tripAggregator and tripTypes[key] in AGGREGATEDTYPES:
+                    # Aggregates are rebuilt from short-term trips
+                    continue
+                storeTrips(vin, key, data)
+                if tripAggregator:
+                    aggregates = tripAggregator.addTrips(vin, parseTrips(data))
+                    for aggKey, tripType in TRIPDATA:
+                        if aggregates.get(tripType.value):
+                            storeTrips(vin, aggKey, None, aggregates[tripType.value])
+            else:
+                continue
+            counts[record["kind"]] = counts[record["kind"]] + 1
+
+        if self.influxSink:
+            self.influxSink.flush(True)
+        self.csvSinks.sync()
+        if self.parquetSinks:
+            self.parquetSinks.sync()
+        logger.info(
+            "Replay completed: %s status and %s trip records",
+            counts[STATUS],
+            counts[TRIPS],
+        )
+        return counts
+
+    def stop(self):
+        """
+        Request run() to stop after the current cycle
+
+        May be called from another thread or a signal handler.
+        Waiting for the next cycle is interrupted.
+        """
+        self.stopEvent.set()
+
+    def close(self):
+        """
+        Log out and release sinks
+        """
+        if not self.started:
+            return
+        for session in self.sessions:
+            session.logout()
+        self.fetchPool.close()
+        self.csvSinks.close()
+        if self.parquetSinks:
+            self.parquetSinks.close()
+            self.parquetSinks = None
+        if self.archive:
+            self.archive.close()
+            self.archive = None
+        self._closeSinks()
+        if self.ownTracer:
+            self.tracer.close()
+            self.tracer = None
+        self.started = False
+
+    def _closeSinks(self):
+        if self.influxSink:
+            self.influxSink.close()
+            self.influxSink = None
+        if self.influxClient:
+            self.influxClient.close()
+            self.influxClient = None
+            self.influxWriteAPI = None
+        if self.metricsServer:
+            self.metricsServer.close()
+            self.metricsServer = None
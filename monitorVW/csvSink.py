@@ -0,0 +1,228 @@
+"""
+Module csvSink
+
+Long-lived, buffered csv output files.
+
+A CsvSink keeps its file open across cycles and writes rows with the csv module.
+The header of an existing file is read once when the file is opened.
+If it does not match the expected header, the existing file is rotated.
+
+Files can be rotated by size or age. Rotated files get a timestamp suffix.
+The age of an existing file is determined from the first timestamp in its
+first data row (modification time if there is none), so that it is
+independent of restarts.
+
+fsync policies:
+- "none":   data are flushed by the OS
+- "cycle":  data are flushed and synced at the end of each cycle (sync())
+- "always": data are flushed and synced after each row
+"""
+
+import csv
+import datetime
+import os
+import time
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+FSYNC_NONE = "none"
+FSYNC_CYCLE = "cycle"
+FSYNC_ALWAYS = "always"
+FSYNC_POLICIES = [FSYNC_NONE, FSYNC_CYCLE, FSYNC_ALWAYS]
+
+
+class CsvSink:
+    """
+    Append-only csv file with persistent file handle
+    """
+
+    def __init__(
+        self,
+        path: str,
+        header: list,
+        delimiter: str = ";",
+        fsync: str = FSYNC_CYCLE,
+        maxBytes: int = 0,
+        rotateDays: float = 0,
+    ):
+        """
+        path:       file path
+        header:     list of column titles
+        delimiter:  column separator
+        fsync:      fsync policy
+        maxBytes:   rotate when the file exceeds this size (0: no size limit)
+        rotateDays: rotate when the file is older than this (0: no age limit);
+                    the age is counted from the first data row
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Invalid fsync policy: " + str(fsync))
+        self.path = path
+        self.header = list(header)
+        self.delimiter = delimiter
+        self.fsync = fsync
+        self.maxBytes = maxBytes
+        self.rotateAge = rotateDays * 86400
+        self.f = None
+        self.writer = None
+        self.opened = None
+        self.dirty = False
+
+    def _readHeader(self):
+        """
+        Read header of existing file, or None if the file is empty or missing
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return None
+        with open(self.path, "r", newline="") as f:
+            reader = csv.reader(f, delimiter=self.delimiter)
+            return next(reader, None)
+
+    def _started(self):
+        """
+        Start time (epoch) of an existing file
+
+        This is the first ISO timestamp in the first data row,
+        or the modification time if the file contains no timestamp.
+        """
+        with open(self.path, "r", newline="") as f:
+            reader = csv.reader(f, delimiter=self.delimiter)
+            next(reader, None)
+            row = next(reader, None)
+        for value in row or []:
+            if len(value) < 10 or value[4:5] != "-":
+                continue
+            try:
+                ts = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                continue
+            if ts.tzinfo is None:
+                ts = ts.replace(tzinfo=datetime.UTC)
+            return min(ts.timestamp(), time.time())
+        return os.path.getmtime(self.path)
+
+    def open(self):
+        """
+        Open file for appending; write header to a new file
+        """
+        existingHeader = self._readHeader()
+        if existingHeader is not None and existingHeader != self.header:
+            logger.warning("Header of %s does not match. Rotating file", self.path)
+            self._rotateFile()
+            existingHeader = None
+        self.opened = time.time()
+        if existingHeader is not None:
+            self.opened = self._started()
+        self.f = open(self.path, "a", newline="")
+        self.writer = csv.writer(
+            self.f, delimiter=self.delimiter, lineterminator="\n"
+        )
+        if existingHeader is None:
+            self.writer.writerow(self.header)
+            self.dirty = True
+        logger.debug("File opened for csv output: %s", self.path)
+
+    def _rotateFile(self):
+        base, ext = os.path.splitext(self.path)
+        suffix = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        rotated = base + "_" + suffix + ext
+        n = 1
+        while os.path.exists(rotated):
+            rotated = base + "_" + suffix + "_" + str(n) + ext
+            n = n + 1
+        os.replace(self.path, rotated)
+        logger.info("csv file rotated: %s", rotated)
+
+    def _rotationDue(self):
+        if self.maxBytes > 0 and self.f.tell() >= self.maxBytes:
+            return True
+        if self.rotateAge > 0 and time.time() - self.opened >= self.rotateAge:
+            return True
+        return False
+
+    def rotate(self):
+        """
+        Close and rename current file and start a new one
+        """
+        self.close()
+        self._rotateFile()
+        self.open()
+
+    def writeRow(self, row):
+        """
+        Write one data row
+        """
+        if self.f is None:
+            self.open()
+        if self._rotationDue():
+            self.rotate()
+        self.writer.writerow(["" if v is None else v for v in row])
+        self.dirty = True
+        if self.fsync == FSYNC_ALWAYS:
+            self.sync()
+
+    def sync(self):
+        """
+        Flush buffered rows to disk
+        """
+        if self.f is None or not self.dirty:
+            return
+        self.f.flush()
+        if self.fsync != FSYNC_NONE:
+            os.fsync(self.f.fileno())
+        self.dirty = False
+
+    def close(self):
+        """
+        Flush and close file
+        """
+        if self.f is None:
+            return
+        self.sync()
+        self.f.close()
+        self.f = None
+        self.writer = None
+        logger.debug("File closed: %s", self.path)
+
+
+class CsvSinkPool:
+    """
+    One CsvSink per file path, shared across cycles
+    """
+
+    def __init__(self, fsync: str = FSYNC_CYCLE, maxBytes: int = 0, rotateDays: float = 0):
+        self.fsync = fsync
+        self.maxBytes = maxBytes
+        self.rotateDays = rotateDays
+        self.sinks = {}
+
+    def get(self, path: str, header: list):
+        """
+        Return sink for path, creating it if required
+        """
+        sink = self.sinks.get(path)
+        if sink is None:
+            sink = CsvSink(
+                path,
+                header,
+                fsync=self.fsync,
+                maxBytes=self.maxBytes,
+                rotateDays=self.rotateDays,
+            )
+            self.sinks[path] = sink
+        return sink
+
+    def sync(self):
+        """
+        Flush all sinks (end of cycle)
+        """
+        for sink in self.sinks.values():
+            sink.sync()
+
+    def close(self):
+        """
+        Close all sinks
+        """
+        for sink in self.sinks.values():
+            sink.close()
+        self.sinks = {}
@@ -0,0 +1,604 @@
+"""
+Module export
+
+Export of car status and trip data to InfluxDB, csv and Parquet files.
+
+These functions form the pipeline of a polling cycle:
+- storeCarStatusData: status data of a car
+- writeCarStatus:     extracted status data (also used for replay)
+- prefetchTripData:   concurrent requests for trip lists
+- storeTripData:      new trips of one car and trip type
+- backfillTrips:      complete trip history
+They do not hold state of their own; state and sinks are passed in by the caller.
+Only line protocol prefixes are cached per measurement (see lineProtocol).
+"""
+
+import datetime
+from weconnect.elements.trip import Trip
+from weconnect.elements.vehicle import Vehicle
+from requests import codes
+import logging_plus
+from .backfillProgress import BackfillProgress
+from .csvSink import CsvSinkPool
+from .fetchPool import FetchPool
+from .influxSink import InfluxSink
+from .lineProtocol import PRECISION, StatusSerializer, TripSerializer
+from .metrics import Metrics
+from .parquetSink import ParquetSinkPool
+from .requestBudget import RequestBudget, LOGINREQUESTS
+from .stages import Stages
+from .statusDedup import StatusDedup
+from .statusMapping import StatusExtractor
+from .tracing import Tracer, NOTRACER
+from .tripAggregation import AGGREGATEDTYPES
+from .tripCache import TripCache
+from .tripRecord import TripRecord, csvValue, parseTrips
+from .tripState import TripState
+
+logger = logging_plus.getLogger("main")
+
+# Status fields indicating vehicle activity
+ACTIVITYFIELDS = ("mileage", "fuelLevel", "stateOfCharge")
+
+# Metrics for ACTIVITYFIELDS
+VEHICLEMETRICS = (
+    "vehicle_mileage_km",
+    "vehicle_fuel_level_percent",
+    "vehicle_state_of_charge_percent",
+)
+
+# csv columns
+TRIPCSVHEADER = [
+    "id",
+    "tripEndTimestamp",
+    "tripType",
+    "vehicleType",
+    "mileage_km",
+    "startMileage_km",
+    "overallMileage_km",
+    "travelTime",
+    "averageFuelConsumption",
+    "averageElectricConsumption",
+    "averageSpeed_kmph",
+    "averageAuxConsumption",
+    "averageRecuperation",
+]
+
+# Line protocol serializers per measurement
+STATUSSERIALIZER = StatusSerializer("carStatus")
+TRIPSERIALIZERS = {}
+
+# carData sections for trip types
+TRIPDATA = [
+    ("tripDataShortTerm", Trip.TripType.SHORTTERM),
+    ("tripDataLongTerm", Trip.TripType.LONGTERM),
+    ("tripDataCyclic", Trip.TripType.CYCLIC),
+]
+
+
+def measurementTimestamp():
+    """
+    Timestamp (UTC, full seconds) for the car status of the current cycle
+    """
+    local_datetime = datetime.datetime.now()
+    local_datetime_timestamp = round(local_datetime.timestamp())
+    UTC_datetime_converted = datetime.datetime.fromtimestamp(
+        local_datetime_timestamp,
+        datetime.UTC
+    )
+    return UTC_datetime_converted.strftime("%Y-%m-%dT%H:%M:%S.%f000Z")
+
+
+def csvPathForVin(path, vin):
+    """
+    Replace placeholder {vin} in a csv file path
+    """
+    return path.replace("{vin}", vin)
+
+
+def storeCarStatusData(
+    vehicle,
+    vin,
+    csvOut,
+    influxOut,
+    csvPath,
+    influxWriteAPI,
+    influxOrg,
+    influxBucket,
+    csvSinks: CsvSinkPool = None,
+    statusExtractor: StatusExtractor = None,
+    statusDedup: StatusDedup = None,
+    tracer: Tracer = NOTRACER,
+    timestamp: str = None,
+    parquetSinks: ParquetSinkPool = None,
+):
+    """
+    Store car status data in InfluxDB or file
+
+    Fields and tags are extracted according to the statusFields mapping.
+    By default, the following car data are handled:
+    +----------------+-----------+-----------------------------------------------------------+
+    | name           | type      | Source                                                    |
+    +----------------+-----------+-----------------------------------------------------------+
+    | vin            | tag       | car.vehicleIdentificationNumber                           |
+    | mileage        | field     | measurements/odometerStatus/odometer                      |
+    | fuelLevel      | field     | measurements/fuelLevelStatus/currentFuelLevel_pct         |
+    | stateOfCharge  | field     | measurements/fuelLevelStatus/currentSOC_pct               |
+
+    If statusDedup is given, the status is only written if a value has changed
+    or the heartbeat interval has elapsed.
+    timestamp is the time of the measurement (default: now).
+    If parquetSinks are given, the status is also written to Parquet files.
+
+    Returns the tuple (mileage, fuelLevel, stateOfCharge)
+    """
+    if timestamp is None:
+        timestamp = measurementTimestamp()
+    if statusExtractor is None:
+        statusExtractor = StatusExtractor()
+
+    fields, tags = statusExtractor.extract(vehicle)
+    activity = tuple(fields.get(name) for name in ACTIVITYFIELDS)
+
+    if statusDedup and not statusDedup.required(vin, fields, tags):
+        logger.debug("car status unchanged - not written")
+        return activity
+
+    writeCarStatus(
+        vin,
+        tags,
+        fields,
+        timestamp,
+        csvOut,
+        influxOut,
+        csvPath,
+        influxWriteAPI,
+        influxOrg,
+        influxBucket,
+        csvSinks,
+        tracer,
+        parquetSinks,
+    )
+
+    if statusDedup:
+        statusDedup.commit(vin, fields, tags)
+
+    return activity
+
+
+def writeCarStatus(
+    vin,
+    tags: dict,
+    fields: dict,
+    timestamp: str,
+    csvOut,
+    influxOut,
+    csvPath,
+    influxWriteAPI,
+    influxOrg,
+    influxBucket,
+    csvSinks: CsvSinkPool = None,
+    tracer: Tracer = NOTRACER,
+    parquetSinks: ParquetSinkPool = None,
+):
+    """
+    Write extracted car status data to InfluxDB, csv and Parquet files
+    """
+    measurement = "carStatus"
+    if influxOut:
+        with tracer.span("statusInflux", vin=vin):
+            line = STATUSSERIALIZER.line(vin, tags, fields, timestamp)
+            if line:
+                influxWriteAPI.write(
+                    bucket=influxBucket,
+                    org=influxOrg,
+                    record=line,
+                    write_precision=PRECISION,
+                )
+        logger.debug("car status data written to InfluxDB")
+
+    if csvOut:
+        with tracer.span("statusCsv", vin=vin):
+            header = ["_measurement", "_time", "vin"] + list(tags) + list(fields)
+            csvSinks.get(csvPath, header).writeRow(
+                [measurement, timestamp, vin] + list(tags.values()) + list(fields.values())
+            )
+        logger.debug("car status data written to csv file")
+
+    if parquetSinks:
+        with tracer.span("statusParquet", vin=vin):
+            parquetSinks.writeStatus(vin, timestamp, tags, fields)
+        logger.debug("car status data written to Parquet file")
+
+
+def fetchAllTrips(
+    vehicle: Vehicle,
+    tripType: Trip.TripType = Trip.TripType.SHORTTERM,
+    force: bool = False,
+):
+    """
+    Fetch and parse all trips of the given type
+    """
+    data = fetchTripData(vehicle, tripType, force)
+    return parseTrips(data)
+
+
+def fetchTripData(
+    vehicle: Vehicle,
+    tripType: Trip.TripType = Trip.TripType.SHORTTERM,
+    force: bool = False,
+):
+    """
+    Fetch raw trip data of the given type from WeConnect
+
+    This function does not modify the vehicle and can be run concurrently.
+    """
+    url = (
+        "https://emea.bff.cariad.digital/vehicle/v1/trips/"
+        + vehicle.vin.value
+        + "/"
+        + tripType.value.lower()
+    )
+
+    data = vehicle.weConnect.fetchData(
+        url,
+        force,
+        allowEmpty=True,
+        allowHttpError=True,
+        allowedErrors=[
+            codes["not_found"],
+            codes["no_content"],
+            codes["bad_gateway"],
+            codes["forbidden"],
+        ],
+    )
+    return data
+
+
+def tripOutputRequired(conf):
+    """
+    Check whether trip data of a carData section need to be fetched
+    """
+    return conf["InfluxOutput"] or conf["csvOutput"] or conf.get("parquetOutput", False)
+
+
+def tripRequests(cfgc, aggregate: bool = False):
+    """
+    carData keys and trip types for which trip lists are requested
+
+    With local aggregation, long-term and cyclic trips are not requested,
+    while short-term trips are always required.
+    """
+    requests = []
+    for key, tripType in TRIPDATA:
+        if aggregate and tripType in AGGREGATEDTYPES:
+            continue
+        if aggregate and tripType == Trip.TripType.SHORTTERM:
+            requests.append((key, tripType))
+        elif key in cfgc and tripOutputRequired(cfgc[key]):
+            requests.append((key, tripType))
+    return requests
+
+
+def prefetchTripData(
+    fetchPool: FetchPool,
+    vehicles,
+    cfgc,
+    account: str = None,
+    requestBudget: RequestBudget = None,
+    tripCache: TripCache = None,
+    metrics: Metrics = None,
+    tracer: Tracer = NOTRACER,
+    fetchTrips=None,
+    stages: Stages = None,
+    aggregate: bool = False,
+):
+    """
+    Fetch raw trip data of all vehicles and trip types concurrently
+
+    Trip data are not fetched if the request budget of the account is down
+    to the reserve for status updates.
+    Payloads which are identical to the last processed ones are omitted.
+    fetchTrips replaces fetchTripData(vehicle, tripType) as source of trip data.
+    If stages are given, failed requests are retried individually.
+    Every request, including retries, is charged to the request budget.
+    With aggregate, only short-term trips are requested (see tripRequests).
+
+    Returns (tripData, failures):
+    - tripData: dict (vin, carData key) -> raw data
+    - failures: dict (vin, carData key) -> exception of requests which failed
+    """
+    if fetchTrips is None:
+        fetchTrips = fetchTripData
+    if requestBudget:
+        fetchTrips = requestBudget.charged(fetchTrips, account)
+    calls = {}
+    for vin, vehicle in vehicles:
+        for key, tripType in tripRequests(cfgc, aggregate):
+            fetch = fetchTrips
+            if stages:
+                fetch = stages.retrying(fetch, "fetchTrips")
+            if metrics:
+                fetch = metrics.timed(
+                    fetch, "wecon_fetch_seconds", tripType=tripType.value
+                )
+            fetch = tracer.timed(
+                fetch, "fetchTrips", vin=vin, tripType=tripType.value
+            )
+            calls[(vin, key)] = (fetch, (vehicle, tripType))
+    if not calls:
+        return {}, {}
+    if requestBudget:
+        if not requestBudget.allows(account, len(calls), trip=True):
+            logger.warning(
+                "Request budget of %s down to reserve. Trip data skipped", account
+            )
+            return {}, {}
+    logger.debug("fetching %s trip lists", len(calls))
+    tripData, failures = fetchPool.runEach(calls)
+    for (vin, key), error in failures.items():
+        logger.error("Trip data %s of %s could not be fetched: %s", key, vin, error)
+    if tripCache:
+        unchanged = [k for k, data in tripData.items() if not tripCache.changed(*k, data)]
+        for k in unchanged:
+            del tripData[k]
+        logger.debug("%s trip lists unchanged", len(unchanged))
+    return tripData, failures
+
+
+def storeTripData(
+    vehicle,
+    vin,
+    type: Trip.TripType,
+    conf,
+    influxWriteAPI,
+    influxOrg,
+    influxBucket,
+    tripState: TripState = None,
+    data=None,
+    csvSinks: CsvSinkPool = None,
+    tracer: Tracer = NOTRACER,
+    parquetSinks: ParquetSinkPool = None,
+    trips: list = None,
+):
+    """
+    Store trip data in InfluxDB and/or files
+
+    If a tripState is given, only trips which have not yet been exported
+    are written and the watermark is advanced afterwards.
+    If data is given, trips are built from these prefetched data
+    instead of being fetched from WeConnect.
+    If trips are given (e.g. local aggregates), these TripRecords are stored.
+    Trips are written to Parquet files if parquetOutput is set in conf
+    and parquetSinks are given.
+    """
+    if tripOutputRequired(conf):
+        if conf["InfluxOutput"]:
+            measurement = "trip_" + type.value
+            timeStartDates = "1900-01-01"
+            if "InfluxTimeStart" in conf:
+                if conf["InfluxTimeStart"]:
+                    if len(conf["InfluxTimeStart"]) > 0:
+                        timeStartDates = conf["InfluxTimeStart"]
+            timeStartDate = datetime.datetime.fromisoformat(timeStartDates)
+            timePeriods = "9999"
+            if "InfluxDaysBefore" in conf:
+                if conf["InfluxDaysBefore"]:
+                    if len(conf["InfluxDaysBefore"]) > 0:
+                        timePeriods = conf["InfluxDaysBefore"]
+            timePeriod = int(timePeriods)
+            timeStartPeriod = datetime.datetime.now(datetime.UTC) - datetime.timedelta(
+                days=timePeriod
+            )
+
+            timeStart = timeStartDate.replace(tzinfo=datetime.UTC)
+            if timeStartPeriod > timeStart:
+                timeStart = timeStartPeriod
+
+        if conf["csvOutput"]:
+            sink = csvSinks.get(csvPathForVin(conf["csvFile"], vin), TRIPCSVHEADER)
+
+        if trips is None:
+            logger.debug("getting trip data")
+            if data is None:
+                with tracer.span("fetchTrips", vin=vin, tripType=type.value):
+                    data = fetchTripData(vehicle, type)
+            with tracer.span("tripBuild", vin=vin, tripType=type.value):
+                trips = parseTrips(data)
+        logger.debug("%s trips revceived", str(len(trips)))
+        trips = completeTrips(vin, type.value, trips)
+        if tripState:
+            trips = tripState.newTrips(vin, type.value, trips)
+            logger.debug("%s new trips", str(len(trips)))
+        if conf["InfluxOutput"]:
+            with tracer.span("tripInflux", vin=vin, tripType=type.value, trips=len(trips)):
+                tripsToInflux(
+                    measurement,
+                    vin,
+                    [trip for trip in trips if trip.tripEndTimestamp >= timeStart],
+                    influxWriteAPI,
+                    influxOrg,
+                    influxBucket,
+                )
+        if conf["csvOutput"]:
+            with tracer.span("tripCsv", vin=vin, tripType=type.value, trips=len(trips)):
+                for trip in trips:
+                    tripToCsv(trip, sink)
+        if conf.get("parquetOutput", False) and parquetSinks:
+            with tracer.span("tripParquet", vin=vin, tripType=type.value, trips=len(trips)):
+                for trip in trips:
+                    parquetSinks.writeTrip(type.value, vin, trip)
+        if tripState:
+            tripState.commit(vin, type.value, trips)
+
+
+def completeTrips(vin, tripType: str, trips):
+    """
+    Drop trips without tripEndTimestamp, which cannot be ordered or exported
+    """
+    complete = [trip for trip in trips if trip.tripEndTimestamp is not None]
+    if len(complete) < len(trips):
+        logger.warning(
+            "%s %s trips of %s without tripEndTimestamp skipped",
+            len(trips) - len(complete),
+            tripType,
+            vin,
+        )
+    return complete
+
+
+def tripSerializer(measurement: str):
+    """
+    Line protocol serializer for a trip measurement
+    """
+    serializer = TRIPSERIALIZERS.get(measurement)
+    if serializer is None:
+        serializer = TripSerializer(measurement)
+        TRIPSERIALIZERS[measurement] = serializer
+    return serializer
+
+
+def tripsToInflux(
+    measurement, vin, trips, influxWriteAPI, influxOrg, influxBucket
+):
+    """
+    Store a list of trips in Influx
+
+    Consumption is stored per trip, not per 100km.
+    """
+    lines = tripSerializer(measurement).lines(vin, trips)
+    if lines:
+        influxWriteAPI.write(
+            bucket=influxBucket, org=influxOrg, record=lines, write_precision=PRECISION
+        )
+    logger.debug("%s trips written to InfluxDB", len(lines))
+
+
+def tripToInflux(
+    measurement, vin, trip: TripRecord, influxWriteAPI, influxOrg, influxBucket
+):
+    """
+    Store trip data in Influx
+    """
+    tripsToInflux(measurement, vin, [trip], influxWriteAPI, influxOrg, influxBucket)
+
+
+def tripToCsv(trip: TripRecord, sink):
+    """
+    Write trip to CVS file
+
+    Columns are the fields of TripRecord (TRIPCSVHEADER).
+    """
+    sink.writeRow([csvValue(value) for value in trip])
+    logger.debug("trip written to csv file")
+
+
+def backfillTrips(
+    sessions,
+    cfgc,
+    influxSink: InfluxSink,
+    influxOrg,
+    influxBucket,
+    tripState: TripState,
+    progress: BackfillProgress,
+    batchSize: int,
+    requestBudget: RequestBudget = None,
+):
+    """
+    Load all available trips into InfluxDB
+
+    All trip types with InfluxOutput are loaded for all cars, independent of
+    InfluxTimeStart and InfluxDaysBefore.
+    Trips are deduplicated by ID and written in batches of batchSize.
+    Progress is persisted after every batch which InfluxDB has accepted
+    (or which is kept in a durable spool), so that an interrupted backfill
+    can be resumed. A ConnectionError is raised if a batch has been dropped.
+    The trip state is updated, so that regular cycles only export newer trips.
+    If the request budget is exhausted, the backfill stops and can be resumed
+    on the next day.
+    Returns True if the backfill has been completed.
+    """
+    for session in sessions:
+        if not session.loggedIn:
+            updateRequests = 1 + len(session.requestedVins)
+            loginRequests = 0 if session.tokensStored() else LOGINREQUESTS
+            if requestBudget:
+                if not requestBudget.allows(
+                    session.username, loginRequests + updateRequests
+                ):
+                    return _budgetExhausted(session.username)
+                requestBudget.consume(session.username, updateRequests)
+            try:
+                session.login()
+            finally:
+                if requestBudget and session.fullLogin:
+                    requestBudget.consume(session.username, LOGINREQUESTS)
+        for vin, vehicle in session.vehicles():
+            for key, tripType in TRIPDATA:
+                if key not in cfgc or not cfgc[key]["InfluxOutput"]:
+                    continue
+                if progress.isDone(vin, tripType.value):
+                    logger.info("Backfill %s %s: already completed", vin, tripType.value)
+                    continue
+
+                if requestBudget:
+                    if not requestBudget.allows(session.username, 1, trip=True):
+                        return _budgetExhausted(session.username)
+                    requestBudget.consume(session.username)
+                trips = completeTrips(
+                    vin, tripType.value, fetchAllTrips(vehicle, tripType, force=True)
+                )
+                unique = {}
+                for trip in trips:
+                    unique[str(trip.id)] = trip
+                loaded = progress.loaded(vin, tripType.value)
+                todo = [trip for id, trip in unique.items() if id not in loaded]
+                todo.sort(key=lambda trip: trip.tripEndTimestamp)
+                total = len(unique)
+                done = total - len(todo)
+                logger.info(
+                    "Backfill %s %s: %s trips available, %s already loaded",
+                    vin,
+                    tripType.value,
+                    total,
+                    done,
+                )
+
+                measurement = "trip_" + tripType.value
+                for i in range(0, len(todo), batchSize):
+                    batch = todo[i : i + batchSize]
+                    lost = influxSink.lost
+                    tripsToInflux(
+                        measurement, vin, batch, influxSink, influxOrg, influxBucket
+                    )
+                    influxSink.flush(wait=True)
+                    if influxSink.lost > lost:
+                        raise ConnectionError(
+                            "Trips of %s %s could not be written to InfluxDB"
+                            % (vin, tripType.value)
+                        )
+                    progress.addLoaded(
+                        vin, tripType.value, [str(trip.id) for trip in batch]
+                    )
+                    done = done + len(batch)
+                    logger.info(
+                        "Backfill %s %s: %s/%s trips loaded",
+                        vin,
+                        tripType.value,
+                        done,
+                        total,
+                    )
+
+                tripState.commit(vin, tripType.value, list(unique.values()))
+                progress.setDone(vin, tripType.value)
+
+    progress.remove()
+    logger.info("Backfill completed")
+    return True
+
+
+def _budgetExhausted(account: str):
+    logger.warning(
+        "Request budget of %s exhausted. Run backfill again tomorrow to resume", account
+    )
+    return False
@@ -0,0 +1,97 @@
+"""
+Module fetchPool
+
+Bounded thread pool for concurrent WeConnect requests.
+
+The number of requests in flight is limited and consecutive requests are
+started with a minimum spacing in order to respect the backend's rate limits.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+
+class FetchPool:
+    """
+    Runs fetch functions concurrently with limited concurrency and request rate
+    """
+
+    def __init__(self, maxConcurrency: int = 3, minInterval: int = 0):
+        """
+        maxConcurrency: max. number of requests in flight
+        minInterval:    min. time (ms) between the start of two requests
+        """
+        self.maxConcurrency = max(1, maxConcurrency)
+        self.minInterval = minInterval / 1000
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.maxConcurrency, thread_name_prefix="fetchPool"
+        )
+        self.lock = threading.Lock()
+        self.nextStart = 0.0
+
+    def _throttle(self):
+        """
+        Wait until the next request may be started
+        """
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.nextStart)
+            self.nextStart = start + self.minInterval
+        if start > now:
+            time.sleep(start - now)
+
+    def _call(self, fn, args):
+        self._throttle()
+        return fn(*args)
+
+    def run(self, calls: dict):
+        """
+        Execute calls concurrently
+
+        calls: dict key -> (function, args)
+        Returns dict key -> result.
+        If a call fails, the exception of the first failed call (in dict order)
+        is raised after all calls have finished.
+        """
+        results, errors = self.runEach(calls)
+        if errors:
+            raise next(iter(errors.values()))
+        return results
+
+    def runEach(self, calls: dict):
+        """
+        Execute calls concurrently, collecting the exceptions of failed calls
+
+        calls: dict key -> (function, args)
+        Returns (dict key -> result, dict key -> exception), both in dict order.
+        """
+        results = {}
+        errors = {}
+        if self.maxConcurrency == 1 or len(calls) <= 1:
+            for key, (fn, args) in calls.items():
+                try:
+                    results[key] = self._call(fn, args)
+                except Exception as e:
+                    errors[key] = e
+            return results, errors
+
+        futures = {
+            key: self.executor.submit(self._call, fn, args)
+            for key, (fn, args) in calls.items()
+        }
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+        return results, errors
+
+    def close(self):
+        """
+        Shut down worker threads
+        """
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,329 @@
+"""
+Module influxSink
+
+Batched, asynchronous write stage for InfluxDB.
+
+Points are queued and sent as one line protocol request per bucket and batch
+by a background thread.
+Failed requests are retried with exponential backoff.
+
+With a durable spool, every point is committed to disk before it is sent
+and is only removed after InfluxDB has accepted it.
+Points are then never dropped: during an InfluxDB outage they remain in the spool
+and are sent as soon as InfluxDB is available again, also after a restart.
+
+Only connection errors, timeouts, 429 and 5xx responses are retried.
+Batches which InfluxDB rejects permanently (other 4xx, e.g. line protocol or
+field type errors) are not retried, so that they do not block later points;
+a durable spool keeps them in its dead letter table.
+"""
+
+import threading
+import time
+import influxdb_client
+from influxdb_client.rest import ApiException
+import logging_plus
+from .spool import MemoryQueue
+from .tracing import NOTRACER
+
+logger = logging_plus.getLogger("main")
+
+# Upper limit (sec) for the backoff between retries of a durable spool
+MAXRETRYDELAY = 600
+
+# 4xx responses which are retried
+RETRYSTATUS = (408, 429)
+
+
+def isPermanent(error: Exception):
+    """
+    Check whether InfluxDB has rejected a request, so that retrying is futile
+    """
+    status = getattr(error, "status", None) if isinstance(error, ApiException) else None
+    return status is not None and 400 <= status < 500 and status not in RETRYSTATUS
+
+
+class InfluxSink:
+    """
+    Queues points and writes them in batches through a synchronous WriteApi
+
+    The write() method has the same signature as influxdb_client WriteApi.write,
+    so that an InfluxSink can be used wherever a WriteApi was used before.
+    """
+
+    def __init__(
+        self,
+        writeAPI,
+        org: str,
+        batchSize: int = 5000,
+        flushInterval: int = 10000,
+        maxRetries: int = 5,
+        retryInterval: int = 5000,
+        exponentialBase: int = 2,
+        queue=None,
+        metrics=None,
+        tracer=NOTRACER,
+    ):
+        """
+        batchSize:     max. number of points per request
+        flushInterval: max. time (ms) points are kept before being sent
+        maxRetries:    number of retries for a failed request
+                       (not applicable for a durable queue which retries until success)
+        retryInterval: wait time (ms) before the first retry
+        queue:         record queue (default: MemoryQueue)
+        metrics:       Metrics registry for write latency and counts (optional)
+        tracer:        Tracer for timing spans of write requests
+        """
+        self.writeAPI = writeAPI
+        self.org = org
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval / 1000
+        self.maxRetries = maxRetries
+        self.retryInterval = retryInterval / 1000
+        self.exponentialBase = exponentialBase
+        self.queue = queue if queue is not None else MemoryQueue()
+        self.metrics = metrics
+        self.tracer = tracer
+
+        self.pendingCount = len(self.queue)
+        # Number of points dropped without being kept in a durable queue
+        self.lost = 0
+        self.pendingSince = time.monotonic() if self.pendingCount > 0 else None
+        self.retry = 0
+        self.retryAt = None
+        self.flushRequested = self.pendingCount > 0
+        self.stopping = False
+        self.busy = False
+        self.lock = threading.Condition()
+        self.worker = threading.Thread(
+            target=self._run, name="influxSink", daemon=True
+        )
+        self.worker.start()
+
+    def write(self, bucket, org=None, record=None, write_precision=None, **kwargs):
+        """
+        Queue a record (Point, line protocol string or list of these)
+        """
+        if write_precision is None:
+            write_precision = influxdb_client.WritePrecision.NS
+        if org is None:
+            org = self.org
+        if record is None:
+            return
+        if not isinstance(record, list):
+            record = [record]
+        entries = []
+        for rec in record:
+            if isinstance(rec, influxdb_client.Point):
+                line = rec.to_line_protocol()
+                precision = rec.write_precision
+            else:
+                line = rec
+                precision = write_precision
+            if line:
+                entries.append((bucket, org, precision, line))
+        if not entries:
+            return
+
+        self.queue.append(entries)
+        with self.lock:
+            self.pendingCount = self.pendingCount + len(entries)
+            if self.pendingSince is None:
+                self.pendingSince = time.monotonic()
+            if self.pendingCount >= self.batchSize:
+                self.flushRequested = True
+                self.lock.notify_all()
+
+    def flush(self, wait: bool = False, timeout: float = None):
+        """
+        Request sending of all pending points
+
+        With wait=True, block until all points have been sent
+        or the sink is waiting for a retry.
+        """
+        with self.lock:
+            self.flushRequested = True
+            self.lock.notify_all()
+            if wait:
+                self.lock.wait_for(
+                    lambda: not self.busy
+                    and (
+                        self.retryAt is not None
+                        or (not self.flushRequested and self.pendingCount == 0)
+                    ),
+                    timeout=timeout,
+                )
+
+    def close(self, timeout: float = None):
+        """
+        Send pending points and stop the background thread
+
+        Points which could not be sent remain in a durable queue.
+        """
+        with self.lock:
+            self.stopping = True
+            self.lock.notify_all()
+        self.worker.join(timeout)
+        self.queue.close()
+
+    def _due(self):
+        if self.stopping:
+            return True
+        if self.retryAt is not None:
+            return time.monotonic() >= self.retryAt
+        if self.flushRequested:
+            return True
+        return (
+            self.pendingSince is not None
+            and time.monotonic() - self.pendingSince >= self.flushInterval
+        )
+
+    def _timeout(self):
+        if self.retryAt is not None:
+            return max(0, self.retryAt - time.monotonic())
+        if self.pendingSince is not None:
+            return max(0, self.pendingSince + self.flushInterval - time.monotonic())
+        return None
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self._due():
+                    self.lock.wait(self._timeout())
+                self.busy = True
+                self.flushRequested = False
+                self.retryAt = None
+                stopping = self.stopping
+
+            try:
+                ok = self._drain(single=stopping)
+            except Exception as error:
+                # Errors of the queue itself, e.g. a full or locked spool database
+                logger.error(
+                    "Queue for InfluxDB failed (%s): %s", error.__class__.__name__, error
+                )
+                if self.metrics:
+                    self.metrics.inc("influx_write_errors_total", bucket="")
+                ok = False
+
+            with self.lock:
+                self.busy = False
+                self.lock.notify_all()
+                if stopping:
+                    return
+                if not ok:
+                    self._scheduleRetry()
+
+    def _drain(self, single: bool = False):
+        """
+        Send queued records batch by batch until the queue is empty
+
+        Returns False if a request failed.
+        """
+        while True:
+            batch = self.queue.peek(self.batchSize)
+            if not batch:
+                with self.lock:
+                    # Records may have been queued since peek
+                    self.pendingCount = len(self.queue)
+                    if self.pendingCount == 0:
+                        self.pendingSince = None
+                return True
+            if not self._send(batch, single):
+                return False
+            self.queue.remove(batch)
+            with self.lock:
+                self.pendingCount = max(0, self.pendingCount - len(batch))
+                self.retry = 0
+
+    def _send(self, batch, single: bool = False):
+        """
+        Send one batch of records with the same bucket, org and precision
+
+        A MemoryQueue retries up to maxRetries and then drops the batch.
+        A durable queue returns False after a failure and retries later.
+        A batch rejected by InfluxDB is dropped (moved to the dead letter table
+        of a durable queue) without retry.
+        """
+        bucket, org, precision = batch[0][1:4]
+        body = "\n".join(record[4] for record in batch)
+        while True:
+            start = time.perf_counter()
+            try:
+                with self.tracer.span("influxWrite", bucket=bucket, points=len(batch)):
+                    self.writeAPI.write(
+                        bucket=bucket, org=org, record=body, write_precision=precision
+                    )
+                logger.debug("%s points written to bucket %s", len(batch), bucket)
+                if self.metrics:
+                    self.metrics.observe(
+                        "influx_write_seconds", time.perf_counter() - start, bucket=bucket
+                    )
+                    self.metrics.inc("influx_points_written_total", len(batch), bucket=bucket)
+                return True
+            except Exception as error:
+                if self.metrics:
+                    self.metrics.inc("influx_write_errors_total", bucket=bucket)
+                if isPermanent(error):
+                    logger.error(
+                        "Write of %s points to bucket %s rejected by InfluxDB: %s",
+                        len(batch),
+                        bucket,
+                        error,
+                    )
+                    if self.metrics:
+                        self.metrics.inc(
+                            "influx_points_rejected_total", len(batch), bucket=bucket
+                        )
+                    self.queue.reject(batch, str(error))
+                    if not self.queue.durable:
+                        self.lost = self.lost + len(batch)
+                    self.retry = 0
+                    return True
+                if self.queue.durable:
+                    logger.warning(
+                        "Write of %s points to bucket %s failed (%s). Kept in spool.",
+                        len(batch),
+                        bucket,
+                        error,
+                    )
+                    return False
+                if self.retry >= self.maxRetries or single:
+                    logger.error(
+                        "Write of %s points to bucket %s failed after %s retries: %s",
+                        len(batch),
+                        bucket,
+                        self.retry,
+                        error,
+                    )
+                    self.lost = self.lost + len(batch)
+                    self.retry = 0
+                    return True
+                delay = self._retryDelay()
+                self.retry = self.retry + 1
+                logger.warning(
+                    "Write to bucket %s failed (%s). Retry %s in %s sec.",
+                    bucket,
+                    error,
+                    self.retry,
+                    delay,
+                )
+                time.sleep(delay)
+
+    def _retryDelay(self):
+        return min(
+            MAXRETRYDELAY, self.retryInterval * self.exponentialBase**self.retry
+        )
+
+    def _scheduleRetry(self):
+        """
+        Schedule next attempt for a durable queue with exponential backoff
+        """
+        delay = self._retryDelay()
+        self.retry = self.retry + 1
+        self.retryAt = time.monotonic() + delay
+        logger.info(
+            "%s points in spool. Next write attempt in %s sec.",
+            self.pendingCount,
+            delay,
+        )
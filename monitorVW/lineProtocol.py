@@ -0,0 +1,200 @@
+"""
+Module lineProtocol
+
+Serialization of car status and trips to InfluxDB line protocol.
+
+Lines are built directly from status values and TripRecords instead of
+building an influxdb_client Point per record. They are identical to the lines
+produced by Point.to_line_protocol():
+- measurement, keys and tag values escaped in the same way
+- tags and fields sorted by key; tags without value omitted
+- fields which are None or not finite omitted; integers with suffix "i"
+- timestamps with millisecond precision
+
+Everything that is constant for a VIN and trip type (measurement, tags, field keys)
+is serialized once and reused.
+"""
+
+import datetime
+import math
+from influxdb_client import WritePrecision
+from .tripRecord import TripRecord
+
+# Precision of all timestamps
+PRECISION = WritePrecision.MS
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+
+_ESCAPE_MEASUREMENT = str.maketrans(
+    {",": r"\,", " ": r"\ ", "\n": r"\n", "\t": r"\t", "\r": r"\r"}
+)
+_ESCAPE_KEY = str.maketrans(
+    {",": r"\,", "=": r"\=", " ": r"\ ", "\n": r"\n", "\t": r"\t", "\r": r"\r"}
+)
+_ESCAPE_STRING = str.maketrans({'"': r"\"", "\\": r"\\"})
+
+
+def escapeMeasurement(name) -> str:
+    return str(name).translate(_ESCAPE_MEASUREMENT)
+
+
+def escapeKey(key) -> str:
+    return str(key).translate(_ESCAPE_KEY)
+
+
+def escapeTagValue(value) -> str:
+    value = escapeKey(value)
+    if value.endswith("\\"):
+        value = value + " "
+    return value
+
+
+def formatFieldValue(value):
+    """
+    Field value in line protocol, or None if the field is to be omitted
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value) + "i"
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return None
+        s = str(value)
+        return s[:-2] if s.endswith(".0") else s
+    if isinstance(value, str):
+        return '"' + value.translate(_ESCAPE_STRING) + '"'
+    raise ValueError('Type: "%s" of field value is not supported.' % type(value))
+
+
+def timestampMs(ts) -> int:
+    """
+    Epoch milliseconds of a datetime (naive: UTC) or ISO timestamp
+    """
+    if isinstance(ts, str):
+        ts = datetime.datetime.fromisoformat(ts)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.UTC)
+    return (ts - EPOCH) // datetime.timedelta(milliseconds=1)
+
+
+def tagSet(tags: dict) -> str:
+    """
+    Sorted, escaped tag set including the leading comma
+    """
+    parts = []
+    for key, value in sorted(tags.items()):
+        if value is None:
+            continue
+        key = escapeKey(key)
+        value = escapeTagValue(value)
+        if key != "" and value != "":
+            parts.append(key + "=" + value)
+    return "," + ",".join(parts) if parts else ""
+
+
+class StatusSerializer:
+    """
+    Lines of a status measurement with cached prefixes per VIN and tag values
+    """
+
+    def __init__(self, measurement: str):
+        self.measurement = escapeMeasurement(measurement)
+        # (vin, tag items) -> "measurement,tags "
+        self.prefixes = {}
+        # field names -> sorted list of (name, "key=")
+        self.fieldKeys = {}
+
+    def line(self, vin: str, tags: dict, fields: dict, timestamp) -> str:
+        """
+        Line for one status; empty if no field has a value
+        """
+        key = (vin, tuple(tags.items()))
+        prefix = self.prefixes.get(key)
+        if prefix is None:
+            allTags = dict(tags)
+            allTags["vin"] = vin
+            prefix = self.measurement + tagSet(allTags) + " "
+            self.prefixes[key] = prefix
+        names = tuple(fields)
+        keys = self.fieldKeys.get(names)
+        if keys is None:
+            keys = [(name, escapeKey(name) + "=") for name in sorted(names)]
+            self.fieldKeys[names] = keys
+        fieldSet = []
+        for name, fieldKey in keys:
+            value = formatFieldValue(fields[name])
+            if value is not None:
+                fieldSet.append(fieldKey + value)
+        if not fieldSet:
+            return ""
+        return prefix + ",".join(fieldSet) + " " + str(timestampMs(timestamp))
+
+
+class TripSerializer:
+    """
+    Lines of a trip measurement with cached prefixes per VIN
+
+    Tags: reportReason, tripID, vin
+    Fields: electricPowerConsumed, fuelConsumed (per trip, not per 100 km),
+            startMileage, traveltime, tripMileage
+    """
+
+    def __init__(self, measurement: str, reportReason: str = "clamp15off"):
+        # Tags in sorted order; tripID differs per trip
+        self.headWithoutId = escapeMeasurement(measurement) + tagSet(
+            {"reportReason": reportReason}
+        )
+        self.head = self.headWithoutId + ",tripID="
+        # vin -> ",vin=<vin> "
+        self.tails = {}
+
+    def line(self, vin: str, trip: TripRecord) -> str:
+        """
+        Line for one trip; empty if no field has a value
+        """
+        tail = self.tails.get(vin)
+        if tail is None:
+            tail = tagSet({"vin": vin}) + " "
+            self.tails[vin] = tail
+        mileage = trip.mileage_km
+        electricPowerConsumed = None
+        fuelConsumed = None
+        if mileage is not None:
+            if trip.averageElectricConsumption is not None:
+                electricPowerConsumed = trip.averageElectricConsumption * mileage / 100
+            if trip.averageFuelConsumption is not None:
+                fuelConsumed = trip.averageFuelConsumption * mileage / 100
+        fields = (
+            ("electricPowerConsumed=", electricPowerConsumed),
+            ("fuelConsumed=", fuelConsumed),
+            ("startMileage=", trip.startMileage_km),
+            ("traveltime=", trip.travelTime),
+            ("tripMileage=", mileage),
+        )
+        fieldSet = []
+        for fieldKey, value in fields:
+            value = formatFieldValue(value)
+            if value is not None:
+                fieldSet.append(fieldKey + value)
+        if not fieldSet:
+            return ""
+        if trip.id is None:
+            head = self.headWithoutId
+        else:
+            head = self.head + escapeTagValue(trip.id)
+        return (
+            head
+            + tail
+            + ",".join(fieldSet)
+            + " "
+            + str(timestampMs(trip.tripEndTimestamp))
+        )
+
+    def lines(self, vin: str, trips) -> list:
+        """
+        Lines for a list of trips
+        """
+        return [line for line in (self.line(vin, trip) for trip in trips) if line]
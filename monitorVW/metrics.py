@@ -0,0 +1,176 @@
+"""
+Module metrics
+
+Live vehicle and pipeline metrics in Prometheus text format.
+
+Metrics are registered in a Metrics registry which is shared by all stages.
+A MetricsServer serves the registry over HTTP at /metrics,
+so that it can be scraped by Prometheus or any OpenMetrics compatible agent.
+
+Metric types:
+- counter: monotonically increasing value (name ends with _total)
+- gauge:   current value
+- summary: count and sum of observed durations
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+PREFIX = "monitorvw_"
+CONTENTTYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# name -> (type, help)
+METRICS = {
+    "vehicle_mileage_km": ("gauge", "Odometer reading"),
+    "vehicle_fuel_level_percent": ("gauge", "Fuel level"),
+    "vehicle_state_of_charge_percent": ("gauge", "Battery state of charge"),
+    "cycle_duration_seconds": ("summary", "Duration of polling cycles"),
+    "last_cycle_timestamp_seconds": ("gauge", "End time of the last completed cycle"),
+    "wecon_update_seconds": ("summary", "Duration of WeConnect status updates"),
+    "wecon_fetch_seconds": ("summary", "Duration of WeConnect trip requests"),
+    "influx_write_seconds": ("summary", "Duration of InfluxDB write requests"),
+    "influx_points_written_total": ("counter", "Points accepted by InfluxDB"),
+    "influx_write_errors_total": ("counter", "Failed InfluxDB write requests"),
+    "influx_points_rejected_total": ("counter", "Points rejected by InfluxDB"),
+    "influx_pending_points": ("gauge", "Points queued for InfluxDB"),
+    "exceptions_total": ("counter", "Exceptions handled in the main loop"),
+    "stage_retries_total": ("counter", "Retries of failed cycle stages"),
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(k + '="' + _escape(v) + '"' for k, v in labels) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of metric samples
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> value, or [count, sum] for summaries
+        self.samples = {}
+
+    def _key(self, name, labels):
+        if name not in METRICS:
+            raise ValueError("Unknown metric: " + name)
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Increment a counter
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            self.samples[key] = self.samples.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Set a gauge; None removes the sample
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            if value is None:
+                self.samples.pop(key, None)
+            else:
+                self.samples[key] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Add an observation to a summary
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            sample = self.samples.setdefault(key, [0, 0.0])
+            sample[0] = sample[0] + 1
+            sample[1] = sample[1] + seconds
+
+    def timed(self, fn, name: str, **labels):
+        """
+        Wrap a function so that its duration is observed in a summary
+        """
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.observe(name, time.perf_counter() - start, **labels)
+
+        return wrapper
+
+    def render(self):
+        """
+        Return all samples in Prometheus text format
+        """
+        with self.lock:
+            samples = sorted(self.samples.items())
+        lines = []
+        lastName = None
+        for (name, labels), value in samples:
+            fullName = PREFIX + name
+            metricType, text = METRICS[name]
+            if name != lastName:
+                lines.append("# HELP " + fullName + " " + text)
+                lines.append("# TYPE " + fullName + " " + metricType)
+                lastName = name
+            if metricType == "summary":
+                lines.append(fullName + "_count" + _labels(labels) + " " + repr(value[0]))
+                lines.append(fullName + "_sum" + _labels(labels) + " " + repr(value[1]))
+            else:
+                lines.append(fullName + _labels(labels) + " " + repr(float(value)))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    HTTP endpoint serving the metrics registry at /metrics
+    """
+
+    def __init__(self, metrics: Metrics, port: int, address: str = ""):
+        """
+        port:    TCP port
+        address: address to bind to (default: all interfaces)
+        """
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] not in ("/", "/metrics"):
+                    handler.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", CONTENTTYPE)
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                logger.debug("metrics request: " + format, *args)
+
+        self.server = ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="metricsServer", daemon=True
+        )
+        self.thread.start()
+        logger.info("Metrics endpoint listening on port %s", self.server.server_port)
+
+    def close(self):
+        """
+        Stop serving
+        """
+        self.server.shutdown()
+        self.server.server_close()
@@ -4,25 +4,29 @@ Module monitorVW
 
 This module periodically reads data from Volkswagen WeConnect
 and and stores specific car data in an InfluxDB or a CVS file
+
+Command line interface for the Collector.
 """
 
-import time
+import os
+import sys
+
+if __name__ == "__main__" and not __package__:
+    # Run as script: import siblings as part of package monitorVW
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __package__ = "monitorVW"
+
+import copy
 import datetime
-import math
-import os.path
 import json
-import influxdb_client
-from influxdb_client.client.write_api import SYNCHRONOUS
 from weconnect import weconnect
 from weconnect.domain import Domain
-from weconnect.elements.trip import Trip
 from weconnect.elements.vehicle import Vehicle
-from weconnect.errors import (
-    APICompatibilityError,
-    AuthentificationError,
-    TooManyRequestsError,
-)
-from requests import codes
+from .collector import Collector, CFGDEFAULTS
+from .csvSink import FSYNC_POLICIES
+from .parquetSink import COMPRESSIONS as PARQUET_COMPRESSIONS, available as parquetAvailable
+from .statusMapping import StatusExtractor
+from .scheduler import CATCHUP_POLICIES
 
 # Set up logging
 import logging
@@ -33,25 +37,13 @@ logger = logging_plus.getLogger("main")
 
 testRun = False
 servRun = False
+backfillRun = False
+replayRun = False
+replayFrom = None
 
 # Configuration defaults
 cfgFile = ""
-cfg = {
-    "measurementInterval": 1800,
-    "weconUsername": None,
-    "weconPassword": None,
-    "weconSPin": None,
-    "weconCarId": None,
-    "InfluxOutput": False,
-    "InfluxURL": None,
-    "InfluxOrg": None,
-    "InfluxToken": None,
-    "InfluxBucket": None,
-    "InfluxTripBucket": None,
-    "csvOutput": False,
-    "csvFile": "",
-    "carData": [],
-}
+cfg = copy.deepcopy(CFGDEFAULTS)
 
 # Constants
 CFGFILENAME = "monitorVW.json"
@@ -68,6 +60,9 @@ def getCl():
     global logger
     global testRun
     global servRun
+    global backfillRun
+    global replayRun
+    global replayFrom
     global cfgFile
 
     parser = argparse.ArgumentParser(
@@ -103,6 +98,20 @@ def getCl():
         "-v", "--verbose", action="store_true", help="Verbose - log INFO level"
     )
     parser.add_argument("-c", "--config", help="Path to config file to be used")
+    parser.add_argument(
+        "-b",
+        "--backfill",
+        action="store_true",
+        help="Load all available trips into InfluxDB once and exit",
+    )
+    parser.add_argument(
+        "-R",
+        "--replay",
+        nargs="?",
+        const="",
+        metavar="FROM",
+        help="Export the raw data archive (from day FROM, YYYY-MM-DD) again and exit",
+    )
 
     args = parser.parse_args()
 
@@ -195,6 +204,14 @@ def getCl():
     if args.service:
         servRun = True
 
+    if args.backfill:
+        backfillRun = True
+
+    if args.replay is not None:
+        replayRun = True
+        if args.replay:
+            replayFrom = datetime.date.fromisoformat(args.replay)
+
     if testRun:
         logger.debug("Test run mode activated")
     else:
@@ -205,6 +222,12 @@ def getCl():
     else:
         logger.debug("Service run mode deactivated")
 
+    if backfillRun:
+        logger.debug("Backfill mode activated")
+
+    if replayRun:
+        logger.debug("Replay mode activated (from %s)", replayFrom or "start")
+
     if args.config:
         cfgFile = args.config
         logger.debug("Config file: %s", cfgFile)
@@ -272,6 +295,18 @@ def getConfig():
             conf = json.load(f)
             if "measurementInterval" in conf:
                 cfg["measurementInterval"] = conf["measurementInterval"]
+            if "adaptiveInterval" in conf:
+                cfg["adaptiveInterval"] = conf["adaptiveInterval"]
+            if "minInterval" in conf:
+                cfg["minInterval"] = conf["minInterval"]
+            if "maxInterval" in conf:
+                cfg["maxInterval"] = conf["maxInterval"]
+            if "intervalBackoffFactor" in conf:
+                cfg["intervalBackoffFactor"] = conf["intervalBackoffFactor"]
+            if "catchUpPolicy" in conf:
+                cfg["catchUpPolicy"] = conf["catchUpPolicy"]
+            if "cycleJitter" in conf:
+                cfg["cycleJitter"] = conf["cycleJitter"]
             if "weconUsername" in conf:
                 cfg["weconUsername"] = conf["weconUsername"]
             if "weconPassword" in conf:
@@ -280,6 +315,8 @@ def getConfig():
                 cfg["weconSPin"] = conf["weconSPin"]
             if "weconCarId" in conf:
                 cfg["weconCarId"] = conf["weconCarId"]
+            if "accounts" in conf:
+                cfg["accounts"] = conf["accounts"]
             if "InfluxOutput" in conf:
                 cfg["InfluxOutput"] = conf["InfluxOutput"]
             if "InfluxURL" in conf:
@@ -292,728 +329,300 @@ def getConfig():
                 cfg["InfluxBucket"] = conf["InfluxBucket"]
             if "InfluxTripBucket" in conf:
                 cfg["InfluxTripBucket"] = conf["InfluxTripBucket"]
+            if "InfluxBatchSize" in conf:
+                cfg["InfluxBatchSize"] = conf["InfluxBatchSize"]
+            if "InfluxFlushInterval" in conf:
+                cfg["InfluxFlushInterval"] = conf["InfluxFlushInterval"]
+            if "InfluxMaxRetries" in conf:
+                cfg["InfluxMaxRetries"] = conf["InfluxMaxRetries"]
+            if "InfluxRetryInterval" in conf:
+                cfg["InfluxRetryInterval"] = conf["InfluxRetryInterval"]
+            if "InfluxSpool" in conf:
+                cfg["InfluxSpool"] = conf["InfluxSpool"]
+            if "InfluxGzip" in conf:
+                cfg["InfluxGzip"] = conf["InfluxGzip"]
+            if "InfluxPoolSize" in conf:
+                cfg["InfluxPoolSize"] = conf["InfluxPoolSize"]
+            if "InfluxConnectTimeout" in conf:
+                cfg["InfluxConnectTimeout"] = conf["InfluxConnectTimeout"]
+            if "InfluxWriteTimeout" in conf:
+                cfg["InfluxWriteTimeout"] = conf["InfluxWriteTimeout"]
             if "csvOutput" in conf:
                 cfg["csvOutput"] = conf["csvOutput"]
             if "csvFile" in conf:
                 cfg["csvFile"] = conf["csvFile"]
             if cfg["csvFile"] == "":
                 cfg["csvOutput"] = False
+            if "csvFsync" in conf:
+                cfg["csvFsync"] = conf["csvFsync"]
+            if "csvMaxBytes" in conf:
+                cfg["csvMaxBytes"] = conf["csvMaxBytes"]
+            if "csvRotateDays" in conf:
+                cfg["csvRotateDays"] = conf["csvRotateDays"]
+            if "parquetOutput" in conf:
+                cfg["parquetOutput"] = conf["parquetOutput"]
+            if "parquetDir" in conf:
+                cfg["parquetDir"] = conf["parquetDir"]
+            if cfg["parquetDir"] == "":
+                cfg["parquetOutput"] = False
+            if "parquetCompression" in conf:
+                cfg["parquetCompression"] = conf["parquetCompression"]
+            if "parquetRowGroupSize" in conf:
+                cfg["parquetRowGroupSize"] = conf["parquetRowGroupSize"]
+            if "parquetFlushInterval" in conf:
+                cfg["parquetFlushInterval"] = conf["parquetFlushInterval"]
+            if "parquetMaxParts" in conf:
+                cfg["parquetMaxParts"] = conf["parquetMaxParts"]
+            if "stateDir" in conf:
+                cfg["stateDir"] = conf["stateDir"]
+            if "weconMaxConcurrency" in conf:
+                cfg["weconMaxConcurrency"] = conf["weconMaxConcurrency"]
+            if "weconRequestInterval" in conf:
+                cfg["weconRequestInterval"] = conf["weconRequestInterval"]
+            if "weconDailyRequestLimit" in conf:
+                cfg["weconDailyRequestLimit"] = conf["weconDailyRequestLimit"]
+            if "weconTripRequestReserve" in conf:
+                cfg["weconTripRequestReserve"] = conf["weconTripRequestReserve"]
+            if "weconTokenStore" in conf:
+                cfg["weconTokenStore"] = conf["weconTokenStore"]
+            if "weconTokenRenewMargin" in conf:
+                cfg["weconTokenRenewMargin"] = conf["weconTokenRenewMargin"]
+            if "weconDomains" in conf:
+                cfg["weconDomains"] = conf["weconDomains"]
+            if "statusFields" in conf:
+                cfg["statusFields"] = conf["statusFields"]
+            if "statusDedup" in conf:
+                cfg["statusDedup"] = conf["statusDedup"]
+            if "statusHeartbeat" in conf:
+                cfg["statusHeartbeat"] = conf["statusHeartbeat"]
+            if "metricsPort" in conf:
+                cfg["metricsPort"] = conf["metricsPort"]
+            if "metricsAddress" in conf:
+                cfg["metricsAddress"] = conf["metricsAddress"]
+            if "traceSpans" in conf:
+                cfg["traceSpans"] = conf["traceSpans"]
+            if "traceFile" in conf:
+                cfg["traceFile"] = conf["traceFile"]
+            if "tripAggregation" in conf:
+                cfg["tripAggregation"] = conf["tripAggregation"]
+            if "refuelThreshold" in conf:
+                cfg["refuelThreshold"] = conf["refuelThreshold"]
+            if "stageRetries" in conf:
+                cfg["stageRetries"] = conf["stageRetries"]
+            if "stageRetryDelay" in conf:
+                cfg["stageRetryDelay"] = conf["stageRetryDelay"]
+            if "rawArchive" in conf:
+                cfg["rawArchive"] = conf["rawArchive"]
+            if "rawArchiveDir" in conf:
+                cfg["rawArchiveDir"] = conf["rawArchiveDir"]
             if "carData" in conf:
                 cfg["carData"] = conf["carData"]
 
-    # Check WeConnect credentials
-    if not cfg["weconUsername"]:
-        raise ValueError("weconUsername not specified")
-    if not cfg["weconPassword"]:
-        raise ValueError("weconPassword not specified")
-    if not cfg["weconSPin"]:
-        raise ValueError("weconSPin not specified")
-    if not cfg["weconCarId"]:
-        raise ValueError("weconCarId not specified")
-    if isinstance(cfg["weconSPin"], int):
-        cfg["weconSPin"] = str(cfg["weconSPin"]).zfill(4)
-    if isinstance(cfg["weconSPin"], str):
-        if len(cfg["weconSPin"]) != 4:
-            raise ValueError("Wrong S-PIN format: must be 4-digits")
+    # Domains required for status fields are updated in each cycle
+    for domain in StatusExtractor(cfg["statusFields"]).domains():
+        if domain not in cfg["weconDomains"]:
+            cfg["weconDomains"].append(domain)
+    for domain in cfg["weconDomains"]:
         try:
-            d = int(cfg["weconSPin"])
+            Domain(domain)
         except ValueError:
-            raise ValueError("Wrong S-PIN format: must be 4-digits")
-    else:
-        raise ValueError("Wrong S-PIN format: must be 4-digits")
+            raise ValueError("Unknown WeConnect domain in weconDomains: " + str(domain))
+
+    if cfg["csvFsync"] not in FSYNC_POLICIES:
+        raise ValueError("csvFsync must be one of " + str(FSYNC_POLICIES))
+    for key in ("InfluxPoolSize", "InfluxConnectTimeout", "InfluxWriteTimeout"):
+        if not isinstance(cfg[key], int) or cfg[key] < 1:
+            raise ValueError(key + " must be a positive integer")
+    if cfg["parquetCompression"] not in PARQUET_COMPRESSIONS:
+        raise ValueError("parquetCompression must be one of " + str(PARQUET_COMPRESSIONS))
+    if cfg["parquetOutput"] and not parquetAvailable():
+        raise ValueError("parquetOutput requires pyarrow to be installed")
+    if cfg["catchUpPolicy"] not in CATCHUP_POLICIES:
+        raise ValueError("catchUpPolicy must be one of " + str(CATCHUP_POLICIES))
+
+    # Check WeConnect credentials
+    if not cfg["accounts"]:
+        # Single account specified on top level
+        cfg["accounts"] = [
+            {
+                "weconUsername": cfg["weconUsername"],
+                "weconPassword": cfg["weconPassword"],
+                "weconSPin": cfg["weconSPin"],
+                "weconCarId": cfg["weconCarId"],
+            }
+        ]
+    for account in cfg["accounts"]:
+        checkAccount(account)
+
+    # Directory for persistent state (default: user state directory)
+    if not cfg["stateDir"]:
+        cfg["stateDir"] = defaultStateDir()
+        os.makedirs(cfg["stateDir"], exist_ok=True)
+    if not os.path.isdir(cfg["stateDir"]):
+        raise ValueError("stateDir does not exist: " + cfg["stateDir"])
+    if not os.access(cfg["stateDir"], os.W_OK | os.X_OK):
+        raise ValueError(
+            "stateDir is not writable for the user running monitorVW: "
+            + cfg["stateDir"]
+        )
 
     logger.info("Configuration:")
     logger.info("    measurementInterval:%s", cfg["measurementInterval"])
+    logger.info("    adaptiveInterval:%s", cfg["adaptiveInterval"])
+    logger.info("    minInterval:%s", cfg["minInterval"])
+    logger.info("    maxInterval:%s", cfg["maxInterval"])
+    logger.info("    intervalBackoffFactor:%s", cfg["intervalBackoffFactor"])
+    logger.info("    catchUpPolicy:%s", cfg["catchUpPolicy"])
+    logger.info("    cycleJitter:%s", cfg["cycleJitter"])
     logger.info("    weconUsername:%s", cfg["weconUsername"])
     logger.info("    weconPassword:%s", cfg["weconPassword"])
     logger.info("    weconSPin:%s", cfg["weconSPin"])
     logger.info("    weconCarId:%s", cfg["weconCarId"])
+    for account in cfg["accounts"]:
+        logger.info(
+            "    account:%s cars:%s", account["weconUsername"], account["weconCarId"]
+        )
     logger.info("    InfluxOutput:%s", cfg["InfluxOutput"])
     logger.info("    InfluxURL:%s", cfg["InfluxURL"])
     logger.info("    InfluxOrg:%s", cfg["InfluxOrg"])
     logger.info("    InfluxToken:%s", cfg["InfluxToken"])
     logger.info("    InfluxBucket:%s", cfg["InfluxBucket"])
     logger.info("    InfluxTripBucket:%s", cfg["InfluxTripBucket"])
+    logger.info("    InfluxBatchSize:%s", cfg["InfluxBatchSize"])
+    logger.info("    InfluxFlushInterval:%s", cfg["InfluxFlushInterval"])
+    logger.info("    InfluxMaxRetries:%s", cfg["InfluxMaxRetries"])
+    logger.info("    InfluxRetryInterval:%s", cfg["InfluxRetryInterval"])
+    logger.info("    InfluxSpool:%s", cfg["InfluxSpool"])
+    logger.info("    InfluxGzip:%s", cfg["InfluxGzip"])
+    logger.info("    InfluxPoolSize:%s", cfg["InfluxPoolSize"])
+    logger.info("    InfluxConnectTimeout:%s", cfg["InfluxConnectTimeout"])
+    logger.info("    InfluxWriteTimeout:%s", cfg["InfluxWriteTimeout"])
     logger.info("    csvOutput:%s", cfg["csvOutput"])
     logger.info("    csvFile:%s", cfg["csvFile"])
+    logger.info("    csvFsync:%s", cfg["csvFsync"])
+    logger.info("    csvMaxBytes:%s", cfg["csvMaxBytes"])
+    logger.info("    csvRotateDays:%s", cfg["csvRotateDays"])
+    logger.info("    parquetOutput:%s", cfg["parquetOutput"])
+    logger.info("    parquetDir:%s", cfg["parquetDir"])
+    logger.info("    parquetCompression:%s", cfg["parquetCompression"])
+    logger.info("    parquetRowGroupSize:%s", cfg["parquetRowGroupSize"])
+    logger.info("    parquetFlushInterval:%s", cfg["parquetFlushInterval"])
+    logger.info("    parquetMaxParts:%s", cfg["parquetMaxParts"])
+    logger.info("    stateDir:%s", cfg["stateDir"])
+    logger.info("    weconMaxConcurrency:%s", cfg["weconMaxConcurrency"])
+    logger.info("    weconRequestInterval:%s", cfg["weconRequestInterval"])
+    logger.info("    weconDailyRequestLimit:%s", cfg["weconDailyRequestLimit"])
+    logger.info("    weconTripRequestReserve:%s", cfg["weconTripRequestReserve"])
+    logger.info("    weconTokenStore:%s", cfg["weconTokenStore"])
+    logger.info("    weconTokenRenewMargin:%s", cfg["weconTokenRenewMargin"])
+    logger.info("    weconDomains:%s", cfg["weconDomains"])
+    logger.info("    statusFields:%s", len(cfg["statusFields"]))
+    logger.info("    statusDedup:%s", cfg["statusDedup"])
+    logger.info("    statusHeartbeat:%s", cfg["statusHeartbeat"])
+    logger.info("    metricsPort:%s", cfg["metricsPort"])
+    logger.info("    metricsAddress:%s", cfg["metricsAddress"])
+    logger.info("    traceSpans:%s", cfg["traceSpans"])
+    logger.info("    traceFile:%s", cfg["traceFile"])
+    logger.info("    tripAggregation:%s", cfg["tripAggregation"])
+    logger.info("    refuelThreshold:%s", cfg["refuelThreshold"])
+    logger.info("    stageRetries:%s", cfg["stageRetries"])
+    logger.info("    stageRetryDelay:%s", cfg["stageRetryDelay"])
+    logger.info("    rawArchive:%s", cfg["rawArchive"])
+    logger.info("    rawArchiveDir:%s", cfg["rawArchiveDir"])
     logger.info("    carData:%s", len(cfg["carData"]))
 
 
-def waitForNextCycle(waitUntilMidnight: bool = False):
+def defaultStateDir():
     """
-    Wait for next measurement cycle.
-
-    This function assures that measurements are done at specific times depending on the specified interval
-    In case that measurementInterval is an integer multiple of 60, the waiting time is calculated in a way,
-    that one measurement is done every full hour.
+    Default directory for persistent state: $XDG_STATE_HOME/monitorVW
+    or $HOME/.local/state/monitorVW
     """
-    global cfg
-
-    if waitUntilMidnight:
-        tNow = datetime.datetime.now()
-        waitTimeSec = 24 * 60 * 60 - (
-            3600 * tNow.hour + 60 * tNow.minute + tNow.second + tNow.microsecond / 1000000
-        ) + 1
-        time.sleep(waitTimeSec)
-
-    elif (
-        (cfg["measurementInterval"] % 60 == 0)
-        or (cfg["measurementInterval"] % 120 == 0)
-        or (cfg["measurementInterval"] % 240 == 0)
-        or (cfg["measurementInterval"] % 300 == 0)
-        or (cfg["measurementInterval"] % 360 == 0)
-        or (cfg["measurementInterval"] % 600 == 0)
-        or (cfg["measurementInterval"] % 720 == 0)
-        or (cfg["measurementInterval"] % 900 == 0)
-        or (cfg["measurementInterval"] % 1200 == 0)
-        or (cfg["measurementInterval"] % 1800 == 0)
-    ):
-        tNow = datetime.datetime.now()
-        seconds = 60 * tNow.minute
-        period = math.floor(seconds / cfg["measurementInterval"])
-        waitTimeSec = (period + 1) * cfg["measurementInterval"] - (
-            60 * tNow.minute + tNow.second + tNow.microsecond / 1000000
-        )
-        logger.debug(
-            "At %s waiting for %s sec.",
-            datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"),
-            waitTimeSec,
-        )
-        time.sleep(waitTimeSec)
-    elif (
-        (cfg["measurementInterval"] % 2 == 0)
-        or (cfg["measurementInterval"] % 4 == 0)
-        or (cfg["measurementInterval"] % 5 == 0)
-        or (cfg["measurementInterval"] % 6 == 0)
-        or (cfg["measurementInterval"] % 10 == 0)
-        or (cfg["measurementInterval"] % 12 == 0)
-        or (cfg["measurementInterval"] % 15 == 0)
-        or (cfg["measurementInterval"] % 20 == 0)
-        or (cfg["measurementInterval"] % 30 == 0)
-    ):
-        tNow = datetime.datetime.now()
-        seconds = 60 * tNow.minute + tNow.second
-        period = math.floor(seconds / cfg["measurementInterval"])
-        waitTimeSec = (period + 1) * cfg["measurementInterval"] - seconds
-        logger.debug(
-            "At %s waiting for %s sec.",
-            datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"),
-            waitTimeSec,
-        )
-        time.sleep(waitTimeSec)
-    else:
-        waitTimeSec = cfg["measurementInterval"]
-        logger.debug(
-            "At %s waiting for %s sec.",
-            datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"),
-            waitTimeSec,
-        )
-        time.sleep(waitTimeSec)
-
-
-def storeCarStatusData(
-    vehicle, vin, csvOut, influxOut, csvPath, influxWriteAPI, influxOrg, influxBucket
-):
-    """
-    Store car status data in InfluxDB or file
-
-    The following car data are handled:
-    +----------------+-----------+-----------------------------------------------------------+
-    | name           | type      | Source                                                    |
-    +----------------+-----------+-----------------------------------------------------------+
-    | vin            | tag       | car.vehicleIdentificationNumber                           |
-    | mileage        | field     | vsr.status.distance_covered                               |
-    - tempOutside    | field     | vsr.status.temperature_outside                            |
-    | fuelLevel      | field     | vsr.status.fuel_level                                     |
-    - fuelMethod     | tag       | vsr.status.fuel_method ('0':'measured', '1':'calculated') |
-    | stateOfCharge  | field?    | vsr.status.state_of_charge                                |
-    """
-    sep = ";"
-    measurement = "carStatus"
-
-    mileage = None
-    mileageInt = None
-    if (
-        vehicle.statusExists("measurements", "odometerStatus")
-        and vehicle.domains["measurements"]["odometerStatus"].enabled
-    ):
-        odometerMeasurement = vehicle.domains["measurements"]["odometerStatus"]
-        if (
-            odometerMeasurement.odometer.enabled
-            and odometerMeasurement.odometer is not None
-        ):
-            mileage = odometerMeasurement.odometer.value
-            mileageInt = mileage
-            mileagePr = format(mileageInt)
-
-    fuelLevel = None
-    fuelLevelInt = None
-    if (
-        vehicle.statusExists("measurements", "fuelLevelStatus")
-        and vehicle.domains["measurements"]["fuelLevelStatus"].enabled
-    ):
-        fuelLevelMeasurement = vehicle.domains["measurements"]["fuelLevelStatus"]
-        if (
-            fuelLevelMeasurement.currentFuelLevel_pct.enabled
-            and fuelLevelMeasurement.currentFuelLevel_pct is not None
-        ):
-            fuelLevel = fuelLevelMeasurement.currentFuelLevel_pct.value
-            fuelLevelInt = fuelLevel
-            fuelLevelPr = format(fuelLevelInt)
-
-    stateOfCharge = None
-    stateOfChargeInt = None
-    if (
-        vehicle.statusExists("measurements", "fuelLevelStatus")
-        and vehicle.domains["measurements"]["fuelLevelStatus"].enabled
-    ):
-        batteryStatus = vehicle.domains["measurements"]["fuelLevelStatus"]
-        if (
-            batteryStatus.currentSOC_pct.enabled
-            and batteryStatus.currentSOC_pct is not None
-        ):
-            stateOfCharge = batteryStatus.currentSOC_pct.value
-            stateOfChargeInt = stateOfCharge
-            stateOfChargePr = format(stateOfChargeInt)
-
-    if influxOut:
-        point = (
-            influxdb_client.Point(measurement)
-            .time(mTS, influxdb_client.WritePrecision.MS)
-            .tag("vin", vin)
-            .field("mileage", mileageInt)
-            .field("fuelLevel", fuelLevelInt)
-            .field("stateOfCharge", stateOfChargeInt)
-        )
-        influxWriteAPI.write(bucket=influxBucket, org=influxOrg, record=point)
-        logger.debug("car status data written to InfluxDB")
-
-    if csvOut:
-        title = (
-            "_measurement"
-            + sep
-            + "_time"
-            + sep
-            + "vin"
-            + sep
-            + "mileage"
-            + sep
-            + "fuelLevel"
-            + sep
-            + "stateOfCharge"
-            + "\n"
-        )
-        data = (
-            measurement
-            + sep
-            + mTS
-            + sep
-            + vin
-            + sep
-            + mileagePr
-            + sep
-            + fuelLevelPr
-            + sep
-            + stateOfChargePr
-            + "\n"
-        )
-        writeCsv(csvPath, title, data)
-        logger.debug("car status data written to csv file")
+    stateHome = os.environ.get("XDG_STATE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "state"
+    )
+    return os.path.join(stateHome, "monitorVW")
 
 
-def writeCsv(fp, title, data):
+def checkAccount(account):
     """
-    Write data to CVS file
+    Check WeConnect credentials of an account and normalize S-PIN and VIN list
     """
-    f = None
-    newFile = True
-    if os.path.exists(fp):
-        newFile = False
-    if newFile:
-        f = open(fp, "w")
+    if not account.get("weconUsername"):
+        raise ValueError("weconUsername not specified")
+    if not account.get("weconPassword"):
+        raise ValueError("weconPassword not specified")
+    if not account.get("weconSPin"):
+        raise ValueError("weconSPin not specified")
+    if not account.get("weconCarId"):
+        raise ValueError("weconCarId not specified")
+    if isinstance(account["weconCarId"], str):
+        account["weconCarId"] = [account["weconCarId"]]
+    if isinstance(account["weconSPin"], int):
+        account["weconSPin"] = str(account["weconSPin"]).zfill(4)
+    if isinstance(account["weconSPin"], str):
+        if len(account["weconSPin"]) != 4:
+            raise ValueError("Wrong S-PIN format: must be 4-digits")
+        try:
+            d = int(account["weconSPin"])
+        except ValueError:
+            raise ValueError("Wrong S-PIN format: must be 4-digits")
     else:
-        f = open(fp, "a")
-    logger.debug("File opened: %s", fp)
-
-    if newFile:
-        f.write(title)
-    f.write(data)
-    f.close()
-
-
-def fetchAllTrips(
-    vehicle: Vehicle,
-    tripType: Trip.TripType = Trip.TripType.SHORTTERM,
-    force: bool = False,
-):
-    allTrips = []
-    url = (
-        "https://emea.bff.cariad.digital/vehicle/v1/trips/"
-        + vehicle.vin.value
-        + "/"
-        + tripType.value.lower()
-    )
-
-    data = vehicle.weConnect.fetchData(
-        url,
-        force,
-        allowEmpty=True,
-        allowHttpError=True,
-        allowedErrors=[
-            codes["not_found"],
-            codes["no_content"],
-            codes["bad_gateway"],
-            codes["forbidden"],
-        ],
-    )
-    if data is not None and "data" in data:
-        for datan in data["data"]:
-            if "totalElectricConsumption_kwh" in datan:
-                datan.pop("totalElectricConsumption_kwh")
-            if "totalFuelConsumption_L" in datan:
-                datan.pop("totalFuelConsumption_L")
-            allTrips.append(
-                Trip(
-                    vehicle=vehicle,
-                    parent=vehicle.trips,
-                    tripType=tripType.value,
-                    fromDict=datan,
-                )
-            )
-
-    return allTrips
+        raise ValueError("Wrong S-PIN format: must be 4-digits")
 
 
-def storeTripData(
-    vehicle, vin, type: Trip.TripType, conf, influxWriteAPI, influxOrg, influxBucket
-):
+# ============================================================================================
+# Start __main__
+# ============================================================================================
+#
+def main():
     """
-    Store trip data in InfluxDB and/or file
+    Run monitorVW from the command line
     """
-    f = None
-
-    if conf["InfluxOutput"] or conf["csvOutput"]:
-        if conf["InfluxOutput"]:
-            measurement = "trip_" + type.value
-            timeStartDates = "1900-01-01"
-            if "InfluxTimeStart" in conf:
-                if conf["InfluxTimeStart"]:
-                    if len(conf["InfluxTimeStart"]) > 0:
-                        timeStartDates = conf["InfluxTimeStart"]
-            timeStartDate = datetime.datetime.fromisoformat(timeStartDates)
-            timePeriods = "9999"
-            if "InfluxDaysBefore" in conf:
-                if conf["InfluxDaysBefore"]:
-                    if len(conf["InfluxDaysBefore"]) > 0:
-                        timePeriods = conf["InfluxDaysBefore"]
-            timePeriod = int(timePeriods)
-            timeStartPeriod = datetime.datetime.now(datetime.UTC) - datetime.timedelta(
-                days=timePeriod
-            )
+    # Get Command line options
+    getCl()
 
-            timeStart = timeStartDate.replace(tzinfo=datetime.UTC)
-            if timeStartPeriod > timeStart:
-                timeStart = timeStartPeriod
-
-        if conf["csvOutput"]:
-            fp = conf["csvFile"]
-            f = None
-            newFile = True
-            if os.path.exists(fp):
-                newFile = False
-            if newFile:
-                f = open(fp, "w")
-                titleRequired = True
-            else:
-                f = open(fp, "a")
-                titleRequired = False
-            logger.debug("File opened for csv output: %s", fp)
-
-        logger.debug("getting trip data")
-        trips = fetchAllTrips(vehicle, type)
-        logger.debug("%s trips revceived", str(len(trips)))
-        for trip in trips:
-            if conf["InfluxOutput"]:
-                ts = trip.tripEndTimestamp.value
-                #ts = ts.replace(tzinfo=None)
-                if ts >= timeStart:
-                    tripToInflux(
-                        measurement, vin, trip, influxWriteAPI, influxOrg, influxBucket
-                    )
-            if conf["csvOutput"]:
-                tripToCsv(trip, f, titleRequired)
-                titleRequired = False
-        if f:
-            f.close()
-            logger.debug("File closed: %s", fp)
-
-
-def tripToInflux(measurement, vin, trip: Trip, influxWriteAPI, influxOrg, influxBucket):
-    """
-    Store trip data in Influx
-    """
-    # Calculate consumption per trip not per 100km
-    ts = trip.tripEndTimestamp.value.replace(tzinfo=None)
-    mileage = trip.mileage_km.value
-    avElPwCons = trip.averageElectricConsumption.value
-    avFuelCons = trip.averageFuelConsumption.value
-    electricPowerConsumed = avElPwCons * mileage / 100
-    fuelConsumed = avFuelCons * mileage / 100
-    point = (
-        influxdb_client.Point(measurement)
-        .time(ts, influxdb_client.WritePrecision.MS)
-        .tag("vin", vin)
-        .tag("tripID", trip.id.value)
-        .tag("reportReason", "clamp15off")
-        .field("startMileage", trip.startMileage_km.value)
-        .field("tripMileage", trip.mileage_km.value)
-        .field("traveltime", trip.travelTime.value)
-        .field("electricPowerConsumed", electricPowerConsumed)
-        .field("fuelConsumed", fuelConsumed)
-    )
+    logger.info("=============================================================")
+    logger.info("monitorVW started")
+    logger.info("=============================================================")
 
-    influxWriteAPI.write(bucket=influxBucket, org=influxOrg, record=point)
-    logger.debug("trip written to InfluxDB: %s (%s)", format(trip.id.value), format(ts))
+    # Get configuration
+    getConfig()
 
+    collector = Collector(cfg)
 
-def tripToCsv(trip, fil, titleRequired):
-    """
-    Write trip to CVS file
-    """
-    sep = ";"
-    if titleRequired:
-        title = ""
-        title = title + "id" + sep
-        title = title + "tripEndTimestamp" + sep
-        title = title + "tripType" + sep
-        title = title + "vehicleType" + sep
-        title = title + "mileage_km" + sep
-        title = title + "startMileage_km" + sep
-        title = title + "overallMileage_km" + sep
-        title = title + "travelTime" + sep
-        title = title + "averageFuelConsumption" + sep
-        title = title + "averageElectricConsumption" + sep
-        title = title + "averageSpeed_kmph" + sep
-        title = title + "averageAuxConsumption" + sep
-        title = title + "averageRecuperation" + "\n"
-        fil.write(title)
-
-    data = ""
-    data = data + format(trip.id) + sep
-    data = data + format(trip.tripEndTimestamp) + sep
-    data = data + format(trip.tripType) + sep
-    data = data + format(trip.vehicleType) + sep
-    data = data + format(trip.mileage_km) + sep
-    data = data + format(trip.startMileage_km) + sep
-    data = data + format(trip.overallMileage_km) + sep
-    data = data + format(trip.travelTime) + sep
-    data = data + format(trip.averageFuelConsumption) + sep
-    data = data + format(trip.averageElectricConsumption) + sep
-    data = data + format(trip.averageSpeed_kmph) + sep
-    data = data + format(trip.averageAuxConsumption) + sep
-    data = data + format(trip.averageRecuperation) + "\n"
-    fil.write(data)
-    logger.debug("trip written to csv file")
-
-
-def instWeConnect():
-    """
-    Instantiate connection to WE Connect
-    """
-    # Log in to WeConnect
-    userName = cfg["weconUsername"]
-    password = cfg["weconPassword"]
-    pin = cfg["weconSPin"]
-    logger.debug("Instantiating WeConnect vwc")
-    vwc = weconnect.WeConnect(
-        username=userName, password=password, updateAfterLogin=False, loginOnInit=False
-    )
-    logger.debug("WeConnect vwc instantiated")
-    vwc.login()
-    logger.debug("WeConnect login successful")
-    logger.debug("Updating")
-    vwc.update(
-        updateCapabilities=False,
-        updatePictures=False,
-        force=True,
-        selective=[Domain.MEASUREMENTS],
-    )
-    logger.debug("Update completed")
-
-    # Get car to query
-    theCar = None
-    logger.debug("Searching car in registered cars")
-
-    theCar = None
-    theVin = None
-    logger.debug("getting requested car")
-    for vin, vehicle in vwc.vehicles.items():
-        if vin == cfg["weconCarId"]:
-            theVin = vin
-            theCar = vehicle
-            logger.debug("got car %s", theVin)
-
-    if theCar:
-        return vwc, theVin
-    else:
-        raise ValueError("Requested car not registered at WeConnect")
-
-
-# ============================================================================================
-# Start __main__
-# ============================================================================================
-#
-# Get Command line options
-getCl()
+    if backfillRun:
+        # Load trip history once and exit
+        if not cfg["InfluxOutput"]:
+            raise ValueError("Backfill requires InfluxOutput")
+        try:
+            collector.backfill()
+        except Exception as error:
+            logger.critical("Backfill failed (%s): %s", error.__class__, error)
+            logger.critical("Run backfill again to resume")
+            collector.close()
+            sys.exit(1)
+
+    elif replayRun:
+        # Export archived raw data once and exit
+        try:
+            collector.replay(replayFrom)
+        except Exception as error:
+            logger.critical("Replay failed (%s): %s", error.__class__, error)
+            collector.close()
+            sys.exit(1)
 
-logger.info("=============================================================")
-logger.info("monitorVW started")
-logger.info("=============================================================")
+    elif testRun:
+        # Single cycle without wait
+        collector.run(maxCycles=1, noWait=True)
 
-# Get configuration
-getConfig()
+    else:
+        collector.run()
 
-fb = None
-influxClient = None
-influxWriteAPI = None
+    collector.close()
+    logger.info("=============================================================")
+    logger.info("monitorVW terminated")
+    logger.info("=============================================================")
 
-try:
-    # Instatntiate InfluxDB access
-    if cfg["InfluxOutput"]:
-        influxClient = influxdb_client.InfluxDBClient(
-            url=cfg["InfluxURL"], token=cfg["InfluxToken"], org=cfg["InfluxOrg"]
-        )
-        influxWriteAPI = influxClient.write_api(write_options=SYNCHRONOUS)
-        logger.debug("Influx interface instantiated")
-
-except Exception as error:
-    logger.critical("Unexpected Exception (%s): %s", error.__class__, error.__cause__)
-    logger.critical("Unexpected Exception: %s", error.message)
-    logger.critical("Could not get InfluxDB access")
-    stop = True
-    vwc = None
-    influxClient = None
-    influxWriteAPI = None
-
-
-noWait = False
-waitUntilMidnight = False
-stop = False
-failcount = 0
-exceptioncount = 0
-loggedIn = False
-vwc = None
-newLoginMax = math.floor(3599 / cfg["measurementInterval"])
-newLoginCount = 0
-
-while not stop:
-    try:
-        # Wait unless noWait is set in case of VWError.
-        # Skip waiting for test run
-        if not noWait and not testRun:
-            waitForNextCycle(waitUntilMidnight)
-        noWait = False
-        waitUntilMidnight = False
-
-        logger.debug("monitorVW - cycle started")
-        local_datetime = datetime.datetime.now()
-        local_datetime_timestamp = round(local_datetime.timestamp())
-        UTC_datetime_converted = datetime.datetime.fromtimestamp(
-            local_datetime_timestamp,
-            datetime.UTC
-        )
-        mTS = UTC_datetime_converted.strftime("%Y-%m-%dT%H:%M:%S.%f000Z")
-
-        # Log in to WE Connect
-        if not loggedIn:
-            logger.debug("Login to WeConnect required")
-            [vwc, theVin] = instWeConnect()
-            loggedIn = True
-            logger.debug("Login successful")
-            newLoginCount = 1
-        else:
-            newLoginCount = newLoginCount + 1
-
-        # Store car data
-        logger.debug("getting measurements")
-        vwc.update(
-            updateCapabilities=False,
-            updatePictures=False,
-            force=True,
-            selective=[Domain.MEASUREMENTS],
-        )
-        vehicle = vwc.vehicles[theVin]
-        logger.debug("got measurements")
-        logger.debug("storing car measurement data")
-        storeCarStatusData(
-            vehicle,
-            theVin,
-            cfg["csvOutput"],
-            cfg["InfluxOutput"],
-            cfg["csvFile"],
-            influxWriteAPI,
-            cfg["InfluxOrg"],
-            cfg["InfluxBucket"],
-        )
 
-        if "carData" in cfg:
-            cfgc = cfg["carData"]
-            # Store short term trip data
-            if "tripDataShortTerm" in cfgc:
-                logger.debug("storing trip data shortTerm")
-                storeTripData(
-                    vehicle,
-                    theVin,
-                    Trip.TripType.SHORTTERM,
-                    cfgc["tripDataShortTerm"],
-                    influxWriteAPI,
-                    cfg["InfluxOrg"],
-                    cfg["InfluxTripBucket"],
-                )
-
-            # Store long term trip data
-            if "tripDataLongTerm" in cfgc:
-                logger.debug("storing trip data longTerm")
-                storeTripData(
-                    vehicle,
-                    theVin,
-                    Trip.TripType.LONGTERM,
-                    cfgc["tripDataLongTerm"],
-                    influxWriteAPI,
-                    cfg["InfluxOrg"],
-                    cfg["InfluxTripBucket"],
-                )
-
-            # Store cyclic trip data
-            if "tripDataCyclic" in cfgc:
-                logger.debug("storing trip data cyclic")
-                storeTripData(
-                    vehicle,
-                    theVin,
-                    Trip.TripType.CYCLIC,
-                    cfgc["tripDataCyclic"],
-                    influxWriteAPI,
-                    cfg["InfluxOrg"],
-                    cfg["InfluxTripBucket"],
-                )
-
-        logger.debug("monitorVW - cycle completed")
-
-        if testRun:
-            # Stop in case of test run
-            stop = True
-
-        exceptioncount = 0
-
-        # Force login
-        # del vwc
-        # vwc = None
-        # loggedIn = False
-
-    except AuthentificationError as error:
-        if loggedIn:
-            # if already logged in to WEConnect, it may be possible that the automatic forced login
-            # was not successful. Therefore re-instantiate vwc and try again without waiting
-            logger.error("Unexpected AuthentificationError: %s", error)
-            logger.error("Trying to immediately re-instantiate WE Connect handle vwc")
-            if vwc:
-                del vwc
-                vwc = None
-            loggedIn = False
-            stop = False
-            noWait = True
-        else:
-            # exception occured during login
-            # wait a cycle an try again
-            logger.error("Unexpected AuthentificationError: %s", error)
-            logger.error(
-                "Trying to re-instantiate WE Connect handle vwc in next cycle"
-            )
-            if vwc:
-                del vwc
-                vwc = None
-            loggedIn = False
-            noWait = False
-            stop = False
-            failcount = failcount + 1
-            if failcount > 10:
-                stop = True
-                logger.critical(
-                    "Could not establish connection to WE Connect after %s tries",
-                    failcount,
-                )
-                logger.critical("Stopping")
-                if vwc:
-                    del vwc
-                if influxClient:
-                    del influxClient
-                if influxWriteAPI:
-                    del influxWriteAPI
-
-    except TooManyRequestsError as error:
-        logger.error("Too many requests from your account. Retrying after midnight.")
-        if loggedIn:
-            # if already logged in to WEConnect, logg off and force new login
-            if vehicle:
-                del vehicle
-                vehicle = None
-            if vwc:
-                del vwc
-                vwc = None
-            loggedIn = False
-
-        # In case of too many requests wait until midnight
-        stop = False
-        noWait = False
-        waitUntilMidnight = True
-
-    except APICompatibilityError as error:
-        stop = True
-        logger.critical("Unexpected APICompatibilityError: %s", error)
-        if vwc:
-            del vwc
-        if influxClient:
-            del influxClient
-        if influxWriteAPI:
-            del influxWriteAPI
-        raise error
-
-    except Exception as error:
-        exceptioncount = exceptioncount + 1
-        if exceptioncount <= 10:
-            logger.error("Unexpected Exception (%s): %s", error.__class__, error.__cause__)
-            stop = False
-            noWait = True
-            waitUntilMidnight = False
-            time.sleep(10)
-        else:
-            stop = True
-            logger.critical("Unexpected Exception: %s", error)
-            if vwc:
-                del vwc
-            if influxClient:
-                del influxClient
-            if influxWriteAPI:
-                del influxWriteAPI
-            raise error
-
-    except KeyboardInterrupt:
-        stop = True
-        logger.debug("KeyboardInterrupt")
-        if vwc:
-            del vwc
-        if influxClient:
-            del influxClient
-        if influxWriteAPI:
-            del influxWriteAPI
-if vehicle:
-    del vehicle
-if vwc:
-    del vwc
-if influxClient:
-    del influxClient
-if influxWriteAPI:
-    del influxWriteAPI
-logger.info("=============================================================")
-logger.info("monitorVW terminated")
-logger.info("=============================================================")
+if __name__ == "__main__":
+    main()
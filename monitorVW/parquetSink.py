@@ -0,0 +1,273 @@
+"""
+Module parquetSink
+
+Columnar output of car status and trip data to Parquet files.
+
+Data are partitioned by kind of data, VIN and month:
+
+    <parquetDir>/<kind>/vin=<VIN>/month=<YYYY-MM>/part-<timestamp>.parquet
+
+kind is "carStatus" or "trip_<tripType>", as the InfluxDB measurements.
+The layout follows the Hive convention, so that vin and month are available
+as columns when a directory is read with pyarrow.dataset, pandas, DuckDB or Spark.
+
+Rows are buffered per partition and written as a new part file when
+- the buffer reaches the row group size
+- the oldest buffered row is older than the flush interval (checked by sync())
+- the sink is closed
+Parquet files cannot be appended to. Therefore, the part files of a partition
+are compacted into a single file, sorted by time, when their number exceeds maxParts.
+
+pyarrow is an optional dependency which is only required for Parquet output.
+"""
+
+import datetime
+import os
+import time
+import logging_plus
+from .tripRecord import TripRecord
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging_plus.getLogger("main")
+
+COMPRESSIONS = ["none", "snappy", "gzip", "brotli", "lz4", "zstd"]
+
+STATUSKIND = "carStatus"
+TRIPKINDPREFIX = "trip_"
+
+
+def available():
+    """
+    Check whether pyarrow is installed
+    """
+    return pyarrow is not None
+
+
+def tripSchema():
+    """
+    Arrow schema of trip data, derived from TripRecord
+    """
+    types = {
+        int: pyarrow.int64(),
+        float: pyarrow.float64(),
+        str: pyarrow.string(),
+        datetime.datetime: pyarrow.timestamp("ms", tz="UTC"),
+    }
+    return pyarrow.schema(
+        [(name, types[t]) for name, t in TripRecord.__annotations__.items()]
+    )
+
+
+class ParquetSink:
+    """
+    Buffered Parquet output of one partition
+    """
+
+    def __init__(
+        self,
+        path: str,
+        schema=None,
+        sortKey: str = None,
+        compression: str = "zstd",
+        rowGroupSize: int = 10000,
+        maxParts: int = 48,
+    ):
+        """
+        path:         partition directory
+        schema:       arrow schema (None: inferred from rows)
+        sortKey:      column by which compacted files are sorted
+        compression:  Parquet compression codec
+        rowGroupSize: max. number of rows per row group
+        maxParts:     compact partition when it has more part files
+        """
+        self.path = path
+        self.schema = schema
+        self.sortKey = sortKey
+        self.compression = compression
+        self.rowGroupSize = rowGroupSize
+        self.maxParts = maxParts
+        self.rows = []
+        self.since = None
+        self.seq = 0
+
+    def writeRow(self, row: dict):
+        """
+        Buffer one row; write a part file if the buffer is full
+        """
+        if not self.rows:
+            self.since = time.monotonic()
+        self.rows.append(row)
+        if len(self.rows) >= self.rowGroupSize:
+            self.flush()
+
+    def pendingFor(self):
+        """
+        Time in seconds since the oldest buffered row (0 if nothing is buffered)
+        """
+        if not self.rows:
+            return 0
+        return time.monotonic() - self.since
+
+    def _parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            os.path.join(self.path, name)
+            for name in os.listdir(self.path)
+            if name.endswith(".parquet") and not name.startswith(".")
+        )
+
+    def _writeTable(self, table):
+        """
+        Write table atomically to a new part file
+        """
+        self.seq = self.seq + 1
+        name = "part-%s-%s.parquet" % (
+            datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%S%f"),
+            self.seq,
+        )
+        # Files starting with "." are ignored by readers
+        tmpPath = os.path.join(self.path, "." + name + ".tmp")
+        pyarrow.parquet.write_table(
+            table,
+            tmpPath,
+            row_group_size=self.rowGroupSize,
+            compression=self.compression,
+        )
+        os.replace(tmpPath, os.path.join(self.path, name))
+
+    def flush(self):
+        """
+        Write buffered rows to a new part file and compact the partition if required
+        """
+        if not self.rows:
+            return
+        table = pyarrow.Table.from_pylist(self.rows, schema=self.schema)
+        os.makedirs(self.path, exist_ok=True)
+        self._writeTable(table)
+        logger.debug("%s rows written to %s", len(self.rows), self.path)
+        self.rows = []
+        self.since = None
+        if len(self._parts()) > self.maxParts:
+            self.compact()
+
+    def compact(self):
+        """
+        Merge all part files of the partition into one file
+        """
+        parts = self._parts()
+        if len(parts) < 2:
+            return
+        tables = [pyarrow.parquet.read_table(part, partitioning=None) for part in parts]
+        table = pyarrow.concat_tables(tables, promote_options="permissive")
+        if self.sortKey and self.sortKey in table.column_names:
+            table = table.sort_by(self.sortKey)
+        self._writeTable(table)
+        for part in parts:
+            os.remove(part)
+        logger.debug("%s part files compacted in %s", len(parts), self.path)
+
+
+class ParquetSinkPool:
+    """
+    One ParquetSink per partition, shared across cycles
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        compression: str = "zstd",
+        rowGroupSize: int = 10000,
+        flushInterval: float = 0,
+        maxParts: int = 48,
+    ):
+        """
+        directory:     root directory of the data set
+        compression:   Parquet compression codec (see COMPRESSIONS)
+        rowGroupSize:  max. number of rows per row group
+        flushInterval: max. time in seconds rows are buffered (0: write in every sync())
+        maxParts:      max. number of part files per partition before compaction
+        """
+        if pyarrow is None:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+        if compression not in COMPRESSIONS:
+            raise ValueError("Invalid Parquet compression: " + str(compression))
+        if rowGroupSize < 1:
+            raise ValueError("Parquet row group size must be positive")
+        self.directory = directory
+        self.compression = compression
+        self.rowGroupSize = rowGroupSize
+        self.flushInterval = flushInterval
+        self.maxParts = maxParts
+        self.tripSchema = tripSchema()
+        self.sinks = {}
+
+    def get(self, kind: str, vin: str, month: str, schema=None, sortKey: str = None):
+        """
+        Return sink for a partition, creating it if required
+        """
+        key = (kind, vin, month)
+        sink = self.sinks.get(key)
+        if sink is None:
+            sink = ParquetSink(
+                os.path.join(self.directory, kind, "vin=" + vin, "month=" + month),
+                schema,
+                sortKey,
+                self.compression,
+                self.rowGroupSize,
+                self.maxParts,
+            )
+            self.sinks[key] = sink
+        return sink
+
+    def writeStatus(self, vin: str, timestamp: str, tags: dict, fields: dict):
+        """
+        Buffer car status data
+
+        timestamp: ISO timestamp of the measurement (UTC)
+        """
+        ts = datetime.datetime.fromisoformat(timestamp)
+        row = {"_time": ts}
+        row.update(tags)
+        row.update(fields)
+        self.get(STATUSKIND, vin, ts.strftime("%Y-%m"), sortKey="_time").writeRow(row)
+
+    def writeTrip(self, tripType: str, vin: str, trip: TripRecord):
+        """
+        Buffer one trip
+
+        Trips without tripEndTimestamp cannot be partitioned and are skipped.
+        """
+        if trip.tripEndTimestamp is None:
+            logger.warning(
+                "%s trip %s of %s without tripEndTimestamp skipped", tripType, trip.id, vin
+            )
+            return
+        self.get(
+            TRIPKINDPREFIX + tripType,
+            vin,
+            trip.tripEndTimestamp.strftime("%Y-%m"),
+            self.tripSchema,
+            "tripEndTimestamp",
+        ).writeRow(trip._asdict())
+
+    def sync(self):
+        """
+        Write rows buffered longer than the flush interval (end of cycle)
+        """
+        for sink in self.sinks.values():
+            if sink.rows and sink.pendingFor() >= self.flushInterval:
+                sink.flush()
+
+    def close(self):
+        """
+        Write all buffered rows
+        """
+        for sink in self.sinks.values():
+            sink.flush()
+        self.sinks = {}
@@ -0,0 +1,132 @@
+"""
+Module requestBudget
+
+Daily WeConnect request budget per account.
+
+WeConnect limits the number of requests per account and day and responds
+with TooManyRequestsError when the limit is exceeded.
+The budget counts requests and throttles proactively before the limit is hit:
+- trip requests are only issued while the remaining budget is above a reserve
+- status updates are only issued while budget is left
+
+Counters are persisted, so that restarts do not reset them.
+The budget is reset at local midnight.
+"""
+
+import datetime
+import json
+import os
+import threading
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+# Estimated number of requests for a login
+LOGINREQUESTS = 5
+
+
+class RequestBudget:
+    """
+    Request counters for all accounts
+    """
+
+    def __init__(self, path: str, limit: int = 0, tripReserve: int = 20):
+        """
+        path:        file for persistence of counters
+        limit:       max. number of requests per account and day (0: no limit)
+        tripReserve: percentage of limit reserved for status updates
+        """
+        self.path = path
+        self.limit = limit
+        self.reserve = limit * tripReserve / 100
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.load()
+
+    def load(self):
+        """
+        Restore counters from file
+        """
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.counters = json.load(f)
+            except (OSError, ValueError) as error:
+                logger.error("Request budget could not be read from %s: %s", self.path, error)
+                self.counters = {}
+
+    def save(self):
+        """
+        Persist counters atomically
+        """
+        if not self.path:
+            return
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(self.counters, f)
+        os.replace(tmpPath, self.path)
+
+    def _counter(self, account: str):
+        today = datetime.date.today().isoformat()
+        counter = self.counters.get(account)
+        if not counter or counter["date"] != today:
+            counter = {"date": today, "used": 0}
+            self.counters[account] = counter
+        return counter
+
+    def used(self, account: str):
+        """
+        Number of requests used today
+        """
+        with self.lock:
+            return self._counter(account)["used"]
+
+    def remaining(self, account: str):
+        """
+        Number of requests left today (None if unlimited)
+        """
+        if not self.limit:
+            return None
+        with self.lock:
+            return max(0, self.limit - self._counter(account)["used"])
+
+    def allows(self, account: str, requests: int, trip: bool = False):
+        """
+        Check whether requests may be issued
+
+        Trip requests must leave the reserve for status updates untouched.
+        """
+        remaining = self.remaining(account)
+        if remaining is None:
+            return True
+        if trip:
+            return remaining - requests >= self.reserve
+        return remaining >= requests
+
+    def consume(self, account: str, requests: int = 1):
+        """
+        Count issued requests
+        """
+        with self.lock:
+            self._counter(account)["used"] += requests
+            self.save()
+
+    def charged(self, fn, account: str):
+        """
+        Wrap a request function so that every call is counted
+        """
+
+        def wrapper(*args, **kwargs):
+            self.consume(account)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    def exhaust(self, account: str):
+        """
+        Mark budget as used up for today (e.g. after TooManyRequestsError)
+        """
+        with self.lock:
+            counter = self._counter(account)
+            counter["used"] = max(counter["used"], self.limit)
+            self.save()
@@ -0,0 +1,159 @@
+"""
+Module scheduler
+
+Scheduling of measurement cycles.
+
+CycleScheduler starts cycles in slots aligned to the epoch (UTC),
+so that cycles do not drift, independent of interval length, daylight saving time
+or the duration of the cycles. Waiting is based on the monotonic clock.
+
+AdaptiveInterval adjusts the measurement interval to vehicle activity:
+- if mileage, fuel level or state of charge of any vehicle changed
+  since the last cycle, the minimum interval is used
+- while nothing changes, the interval is increased exponentially
+  up to the maximum interval
+"""
+
+import datetime
+import random
+import threading
+import time
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+# Policies for slots missed because a cycle took longer than the interval
+CATCHUP_SKIP = "skip"
+CATCHUP_RUN = "run"
+CATCHUP_POLICIES = [CATCHUP_SKIP, CATCHUP_RUN]
+
+
+class CycleScheduler:
+    """
+    Drift-free scheduler with epoch-aligned slots
+    """
+
+    def __init__(
+        self,
+        interval: int,
+        catchUp: str = CATCHUP_SKIP,
+        jitter: float = 0,
+        stopEvent: threading.Event = None,
+    ):
+        """
+        interval:  default interval (sec) between cycles
+        catchUp:   "skip":  missed slots are skipped; wait for the next slot
+                   "run":   after a missed slot, the next cycle is started immediately
+        jitter:    max. random delay (sec) added to each slot
+        stopEvent: event which ends waiting when set
+        """
+        if catchUp not in CATCHUP_POLICIES:
+            raise ValueError("Invalid catch-up policy: " + str(catchUp))
+        self.interval = interval
+        self.catchUp = catchUp
+        self.jitter = jitter
+        self.lastSlot = None
+        self.stopEvent = stopEvent
+
+    def nextSlot(self, interval: int = None, now: float = None):
+        """
+        Return epoch time of the next slot after now
+        """
+        if interval is None:
+            interval = self.interval
+        if now is None:
+            now = time.time()
+        return (now // interval + 1) * interval
+
+    def waitForNextSlot(self, interval: int = None):
+        """
+        Wait until the next cycle is due
+        """
+        if interval is None:
+            interval = self.interval
+        slot = self.nextSlot(interval)
+        missed = slot - interval
+        if (
+            self.catchUp == CATCHUP_RUN
+            and self.lastSlot is not None
+            and missed > self.lastSlot
+        ):
+            logger.debug("Slot %s missed. Starting cycle immediately", missed)
+            self.lastSlot = missed
+            return
+        delay = 0
+        if self.jitter > 0:
+            delay = random.uniform(0, self.jitter)
+        self.sleepUntil(slot + delay)
+        self.lastSlot = slot
+
+    def waitUntilMidnight(self):
+        """
+        Wait until shortly after next local midnight
+        """
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        midnight = datetime.datetime.combine(tomorrow, datetime.time()).astimezone()
+        self.sleepUntil(midnight.timestamp() + 1)
+        self.lastSlot = None
+
+    def sleepUntil(self, epoch: float):
+        """
+        Sleep until the given epoch time, measured with the monotonic clock
+
+        Returns early if the stop event is set.
+        """
+        waitTimeSec = epoch - time.time()
+        logger.debug(
+            "At %s waiting for %s sec.",
+            datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"),
+            waitTimeSec,
+        )
+        deadline = time.monotonic() + waitTimeSec
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.stopEvent is None:
+                time.sleep(remaining)
+            elif self.stopEvent.wait(remaining):
+                break
+
+
+class AdaptiveInterval:
+    """
+    Measurement interval driven by vehicle activity
+    """
+
+    def __init__(self, minInterval: int, maxInterval: int, backoffFactor: float = 2):
+        """
+        minInterval:   interval (sec) while vehicles are active
+        maxInterval:   upper limit (sec) for the interval while vehicles are idle
+        backoffFactor: factor by which the interval is increased per idle cycle
+        """
+        self.minInterval = minInterval
+        self.maxInterval = max(minInterval, maxInterval)
+        self.backoffFactor = max(1, backoffFactor)
+        self.interval = minInterval
+        self.lastValues = {}
+
+    def observe(self, values: dict):
+        """
+        Register values of a cycle and return the interval until the next one
+
+        values: dict vin -> tuple of status values (mileage, fuelLevel, stateOfCharge)
+        """
+        changed = False
+        for vin, vals in values.items():
+            if vin in self.lastValues and self.lastValues[vin] != vals:
+                changed = True
+            self.lastValues[vin] = vals
+
+        if changed:
+            self.interval = self.minInterval
+            logger.debug("Vehicle activity detected. Interval: %s sec.", self.interval)
+        else:
+            self.interval = min(
+                self.maxInterval, round(self.interval * self.backoffFactor)
+            )
+            logger.debug("No vehicle activity. Interval: %s sec.", self.interval)
+        return self.interval
@@ -0,0 +1,178 @@
+"""
+Module spool
+
+Queues for line protocol records waiting to be written to InfluxDB.
+
+MemoryQueue keeps records in memory only.
+Spool is a durable, append-only SQLite queue: records are committed to disk
+before they are sent, so that they survive InfluxDB outages and restarts.
+Records rejected by InfluxDB are moved to the table deadletter of the spool.
+"""
+
+import sqlite3
+import threading
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+
+class MemoryQueue:
+    """
+    Non-persistent record queue
+    """
+
+    durable = False
+
+    def __init__(self):
+        self.records = []
+        self.nextId = 0
+        self.lock = threading.Lock()
+
+    def append(self, entries):
+        """
+        Append entries (bucket, org, precision, line)
+        """
+        with self.lock:
+            for entry in entries:
+                self.records.append((self.nextId,) + tuple(entry))
+                self.nextId = self.nextId + 1
+
+    def peek(self, limit: int):
+        """
+        Return up to limit oldest records with the same bucket, org and precision
+        as the oldest record
+
+        Records are returned as (id, bucket, org, precision, line)
+        """
+        with self.lock:
+            if not self.records:
+                return []
+            key = self.records[0][1:4]
+            batch = []
+            for record in self.records:
+                if record[1:4] == key:
+                    batch.append(record)
+                    if len(batch) >= limit:
+                        break
+            return batch
+
+    def remove(self, records):
+        """
+        Remove records returned by peek
+        """
+        ids = {record[0] for record in records}
+        with self.lock:
+            self.records = [r for r in self.records if r[0] not in ids]
+
+    def reject(self, records, reason: str):
+        """
+        Drop records which InfluxDB has rejected
+        """
+        self.remove(records)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.records)
+
+    def close(self):
+        pass
+
+
+class Spool:
+    """
+    Durable record queue in an SQLite database
+    """
+
+    durable = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "bucket TEXT NOT NULL, "
+            "org TEXT, "
+            "precision TEXT NOT NULL, "
+            "line TEXT NOT NULL)"
+        )
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS deadletter ("
+            "id INTEGER PRIMARY KEY, "
+            "bucket TEXT NOT NULL, "
+            "org TEXT, "
+            "precision TEXT NOT NULL, "
+            "line TEXT NOT NULL, "
+            "reason TEXT, "
+            "rejected TEXT DEFAULT CURRENT_TIMESTAMP)"
+        )
+        self.con.commit()
+        count = len(self)
+        if count > 0:
+            logger.info("Spool %s contains %s unsent records", path, count)
+
+    def append(self, entries):
+        """
+        Append entries (bucket, org, precision, line) in one transaction
+        """
+        with self.lock:
+            with self.con:
+                self.con.executemany(
+                    "INSERT INTO spool (bucket, org, precision, line) VALUES (?, ?, ?, ?)",
+                    entries,
+                )
+
+    def peek(self, limit: int):
+        """
+        Return up to limit oldest records with the same bucket, org and precision
+        as the oldest record
+
+        Records are returned as (id, bucket, org, precision, line)
+        """
+        with self.lock:
+            first = self.con.execute(
+                "SELECT bucket, org, precision FROM spool ORDER BY id LIMIT 1"
+            ).fetchone()
+            if first is None:
+                return []
+            return self.con.execute(
+                "SELECT id, bucket, org, precision, line FROM spool "
+                "WHERE bucket = ? AND org IS ? AND precision = ? ORDER BY id LIMIT ?",
+                first + (limit,),
+            ).fetchall()
+
+    def remove(self, records):
+        """
+        Remove records returned by peek
+        """
+        with self.lock:
+            with self.con:
+                self.con.executemany(
+                    "DELETE FROM spool WHERE id = ?", [(r[0],) for r in records]
+                )
+
+    def reject(self, records, reason: str):
+        """
+        Move records which InfluxDB has rejected to the dead letter table
+        """
+        with self.lock:
+            with self.con:
+                self.con.executemany(
+                    "INSERT OR REPLACE INTO deadletter "
+                    "(id, bucket, org, precision, line, reason) VALUES (?, ?, ?, ?, ?, ?)",
+                    [tuple(r) + (reason,) for r in records],
+                )
+                self.con.executemany(
+                    "DELETE FROM spool WHERE id = ?", [(r[0],) for r in records]
+                )
+
+    def __len__(self):
+        with self.lock:
+            return self.con.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.con.close()
@@ -0,0 +1,184 @@
+"""
+Module stages
+
+Retry and checkpointing for the stages of a polling cycle.
+
+A cycle consists of stages, e.g. "refresh" per account, "status" per car,
+"trips" per car and trip type, and the final flushes of the sinks.
+Failed stages are retried according to the class of the error:
+- transient: network errors, timeouts and failed WeConnect requests
+- sink:      local I/O errors, e.g. of csv or Parquet files or the spool
+- auth:      authentication errors; handled by logging in again
+- quota:     too many requests; handled by waiting until midnight
+- fatal:     incompatible WeConnect API
+Errors of other classes and errors remaining after the last retry
+are raised to the caller.
+
+Completed stages are recorded in a checkpoint together with their result.
+If a cycle is repeated after a failure, completed stages are skipped,
+so that a failed stage does not cause WeConnect to be polled again.
+A checkpoint is only valid for a short time (see age()), since the vehicle
+state and trip data it holds become stale.
+"""
+
+import sqlite3
+import threading
+import time
+import requests
+from weconnect.errors import (
+    APICompatibilityError,
+    AuthentificationError,
+    RetrievalError,
+    TooManyRequestsError,
+)
+import logging_plus
+from .metrics import Metrics
+
+logger = logging_plus.getLogger("main")
+
+TRANSIENT = "transient"
+SINK = "sink"
+AUTH = "auth"
+QUOTA = "quota"
+FATAL = "fatal"
+
+# Error classes retried per stage
+RETRYPOLICIES = {
+    "login": (TRANSIENT,),
+    "update": (TRANSIENT,),
+    "fetchTrips": (TRANSIENT,),
+    "status": (SINK,),
+    "trips": (SINK,),
+    "influxFlush": (TRANSIENT, SINK),
+    "csvSync": (SINK,),
+    "parquetSync": (SINK,),
+    "archive": (SINK,),
+    "archiveSync": (SINK,),
+}
+
+# Factor by which the retry delay is increased for every further retry
+BACKOFF = 2
+
+
+def classifyError(error: BaseException):
+    """
+    Class of an error, or None if the error is unexpected
+    """
+    # Order matters: TooManyRequestsError is a RetrievalError,
+    # network errors are OSErrors
+    if isinstance(error, TooManyRequestsError):
+        return QUOTA
+    if isinstance(error, AuthentificationError):
+        return AUTH
+    if isinstance(error, APICompatibilityError):
+        return FATAL
+    if isinstance(
+        error,
+        (RetrievalError, requests.RequestException, ConnectionError, TimeoutError),
+    ):
+        return TRANSIENT
+    if isinstance(error, (OSError, sqlite3.Error)):
+        return SINK
+    return None
+
+
+class Stages:
+    """
+    Checkpoint of completed stages and retry of failed stages
+    """
+
+    def __init__(
+        self,
+        retries: int = 2,
+        retryDelay: float = 5,
+        stopEvent: threading.Event = None,
+        metrics: Metrics = None,
+    ):
+        """
+        retries:    max. number of retries of a failed stage
+        retryDelay: wait time (sec) before the first retry
+        stopEvent:  event which ends waiting and retrying when set
+        metrics:    Metrics registry for retry counts (optional)
+        """
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self.stopEvent = stopEvent
+        self.metrics = metrics
+        # stage key -> result
+        self.completed = {}
+        # Time (monotonic) at which the first stage of the checkpoint was completed
+        self.since = None
+
+    def reset(self):
+        """
+        Forget completed stages (start of a new cycle)
+        """
+        if self.completed:
+            logger.debug("Checkpoint of %s stages discarded", len(self.completed))
+        self.completed = {}
+        self.since = None
+
+    def age(self):
+        """
+        Time in seconds since the first stage of the checkpoint was completed
+        (0 if no stage has been completed)
+        """
+        if self.since is None:
+            return 0
+        return time.monotonic() - self.since
+
+    def run(self, key: tuple, fn, *args):
+        """
+        Run a stage unless it has already been completed
+
+        key: stage name followed by e.g. account, VIN or trip type
+        Returns the result of fn, or the recorded result of a completed stage.
+        """
+        if key in self.completed:
+            logger.debug("Stage %s already completed", key)
+            return self.completed[key]
+        result = self.retrying(fn, key[0])(*args)
+        if not self.completed:
+            self.since = time.monotonic()
+        self.completed[key] = result
+        return result
+
+    def retrying(self, fn, stage: str):
+        """
+        Wrap a function so that errors are retried according to RETRYPOLICIES
+        """
+        retryOn = RETRYPOLICIES.get(stage, ())
+        if not retryOn or self.retries <= 0:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            retry = 0
+            while True:
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as error:
+                    errorClass = classifyError(error)
+                    if errorClass not in retryOn or retry >= self.retries:
+                        raise
+                    if self.stopEvent is not None and self.stopEvent.is_set():
+                        raise
+                    delay = self.retryDelay * BACKOFF**retry
+                    retry = retry + 1
+                    logger.warning(
+                        "Stage %s failed (%s error: %s). Retry %s in %s sec.",
+                        stage,
+                        errorClass,
+                        error,
+                        retry,
+                        delay,
+                    )
+                    if self.metrics:
+                        self.metrics.inc(
+                            "stage_retries_total", stage=stage, errorClass=errorClass
+                        )
+                    if self.stopEvent is None:
+                        time.sleep(delay)
+                    else:
+                        self.stopEvent.wait(delay)
+
+        return wrapper
@@ -0,0 +1,68 @@
+"""
+Module statusDedup
+
+Change-only writing of car status data.
+
+For every vehicle, the last written status values are kept in memory
+and in a JSON file, so that they survive restarts.
+A status is only written if a value has changed since the last written status
+or if the heartbeat interval has elapsed.
+"""
+
+import json
+import os
+import time
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+
+class StatusDedup:
+    """
+    Last written status values per VIN
+    """
+
+    def __init__(self, path: str, heartbeat: int = 3600):
+        """
+        path:      file for persistence of last written values
+        heartbeat: max. time (sec) without writing a status (0: no heartbeat)
+        """
+        self.path = path
+        self.heartbeat = heartbeat
+        self.last = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.last = json.load(f)
+            except (OSError, ValueError) as error:
+                logger.error("Status dedup state could not be read from %s: %s", path, error)
+                self.last = {}
+
+    @staticmethod
+    def _key(fields: dict, tags: dict):
+        return json.dumps([fields, tags], sort_keys=True, default=str)
+
+    def required(self, vin: str, fields: dict, tags: dict, now: float = None):
+        """
+        Check whether a status needs to be written
+        """
+        last = self.last.get(vin)
+        if last is None or last["values"] != self._key(fields, tags):
+            return True
+        if now is None:
+            now = time.time()
+        return self.heartbeat > 0 and now - last["time"] >= self.heartbeat
+
+    def commit(self, vin: str, fields: dict, tags: dict, now: float = None):
+        """
+        Register a status as written
+        """
+        if now is None:
+            now = time.time()
+        self.last[vin] = {"time": now, "values": self._key(fields, tags)}
+        if not self.path:
+            return
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(self.last, f)
+        os.replace(tmpPath, self.path)
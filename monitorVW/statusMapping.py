@@ -0,0 +1,113 @@
+"""
+Module statusMapping
+
+Declarative mapping of WeConnect status attributes to InfluxDB fields and tags.
+
+Each mapping specifies
+- name: name of the field or tag
+- path: "<domain>/<status>/<attribute>[/<attribute>...]"
+        e.g. "measurements/odometerStatus/odometer"
+- tag:  true if the value shall be stored as tag (default: false)
+
+The mappings are compiled once into a StatusExtractor, which looks up
+each domain and status only once per vehicle and cycle.
+
+Values are exported as bool, int, float or str: enums as their values,
+timestamps in ISO format and other types as their string representation.
+"""
+
+import datetime
+import enum
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+# Default mapping
+STATUSFIELDS = [
+    {"name": "mileage", "path": "measurements/odometerStatus/odometer"},
+    {"name": "fuelLevel", "path": "measurements/fuelLevelStatus/currentFuelLevel_pct"},
+    {"name": "stateOfCharge", "path": "measurements/fuelLevelStatus/currentSOC_pct"},
+]
+
+
+class StatusExtractor:
+    """
+    Compiled status mapping
+    """
+
+    def __init__(self, mappings: list = None):
+        """
+        mappings: list of dicts with name, path and optional tag
+        """
+        if mappings is None:
+            mappings = STATUSFIELDS
+        self.fieldNames = []
+        self.tagNames = []
+        # (domain, status) -> list of (name, attribute path, isTag)
+        self.statuses = {}
+        names = set()
+        for mapping in mappings:
+            if "name" not in mapping or "path" not in mapping:
+                raise ValueError("statusFields entry requires name and path: " + str(mapping))
+            name = mapping["name"]
+            if name in names or name == "vin":
+                raise ValueError("Duplicate name in statusFields: " + name)
+            names.add(name)
+            parts = mapping["path"].split("/")
+            if len(parts) < 3 or not all(parts):
+                raise ValueError(
+                    "statusFields path must be <domain>/<status>/<attribute>: "
+                    + mapping["path"]
+                )
+            isTag = bool(mapping.get("tag", False))
+            if isTag:
+                self.tagNames.append(name)
+            else:
+                self.fieldNames.append(name)
+            self.statuses.setdefault((parts[0], parts[1]), []).append(
+                (name, parts[2:], isTag)
+            )
+
+    def domains(self):
+        """
+        Return names of the domains used by the mapping
+        """
+        return {domain for domain, status in self.statuses}
+
+    @staticmethod
+    def _value(obj, attributes):
+        for attr in attributes:
+            obj = getattr(obj, attr, None)
+            if obj is None or not getattr(obj, "enabled", True):
+                return None
+        value = getattr(obj, "value", None)
+        if isinstance(value, enum.Enum):
+            value = value.value
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        return str(value)
+
+    def extract(self, vehicle):
+        """
+        Extract fields and tags of a vehicle
+
+        Returns (fields, tags) as dicts in the order of the mapping.
+        Values which are not available are None.
+        """
+        fields = dict.fromkeys(self.fieldNames)
+        tags = dict.fromkeys(self.tagNames)
+        for (domain, status), attributes in self.statuses.items():
+            if not vehicle.statusExists(domain, status):
+                continue
+            statusObj = vehicle.domains[domain][status]
+            if not statusObj.enabled:
+                continue
+            for name, attrPath, isTag in attributes:
+                value = self._value(statusObj, attrPath)
+                if isTag:
+                    tags[name] = None if value is None else str(value)
+                else:
+                    fields[name] = value
+        return fields, tags
@@ -0,0 +1,124 @@
+"""
+Module tracing
+
+Timing spans for the stages of a polling cycle.
+
+Each span is emitted as one JSON line with the fields
+- ts:     start time (ISO, UTC)
+- cycle:  number of the cycle
+- span:   name of the stage, e.g. "login", "update", "fetchTrips"
+- ms:     duration in milliseconds
+- thread: name of the thread
+- error:  exception class if the stage failed
+plus stage-specific attributes, e.g. vin or tripType.
+
+Lines are appended to a trace file or, if no file is given, logged at INFO level.
+A disabled Tracer has negligible overhead.
+"""
+
+import contextlib
+import datetime
+import json
+import threading
+import time
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+
+class Tracer:
+    """
+    Emits timing spans as JSON lines
+    """
+
+    def __init__(self, enabled: bool = False, path: str = None):
+        """
+        enabled: emit spans
+        path:    trace file (None: log spans)
+        """
+        self.enabled = enabled
+        self.path = path
+        self.cycle = 0
+        self.lock = threading.Lock()
+        self.f = None
+        if enabled and path:
+            self.f = open(path, "a")
+
+    def beginCycle(self):
+        """
+        Start a new cycle
+        """
+        self.cycle = self.cycle + 1
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        """
+        Context manager measuring the enclosed stage
+        """
+        if not self.enabled:
+            yield
+            return
+        ts = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e.__class__.__name__
+            raise
+        finally:
+            self._emit(name, ts, time.perf_counter() - start, error, attrs)
+
+    def timed(self, fn, name: str, **attrs):
+        """
+        Wrap a function so that each call is traced as a span
+        """
+        if not self.enabled:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            with self.span(name, **attrs):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    def record(self, name: str, ts: float, duration: float, **attrs):
+        """
+        Emit a span measured by the caller
+
+        ts:       start time (epoch)
+        duration: duration (sec)
+        """
+        if self.enabled:
+            self._emit(name, ts, duration, None, attrs)
+
+    def _emit(self, name, ts, duration, error, attrs):
+        record = {
+            "ts": datetime.datetime.fromtimestamp(ts, datetime.UTC).isoformat(),
+            "cycle": self.cycle,
+            "span": name,
+            "ms": round(duration * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        if error:
+            record["error"] = error
+        record.update(attrs)
+        line = json.dumps(record, default=str)
+        if self.f is None:
+            logger.info("trace %s", line)
+            return
+        with self.lock:
+            self.f.write(line + "\n")
+            self.f.flush()
+
+    def close(self):
+        """
+        Close trace file
+        """
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+# Disabled tracer used as default
+NOTRACER = Tracer()
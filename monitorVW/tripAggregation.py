@@ -0,0 +1,246 @@
+"""
+Module tripAggregation
+
+Local aggregation of long-term and cyclic trip data from short-term trips.
+
+WeConnect provides three trip lists per car, where long-term and cyclic records
+are aggregations of the individual short-term trips. With local aggregation,
+only short-term trips are requested and the aggregates are built here:
+- longTerm: trips ending in the same calendar month (UTC)
+- cyclic:   trips from one refuelling to the next
+
+Refuelling is detected from the car status: if the fuel level has risen by at
+least refuelThreshold percentage points since the previous status, the mileage
+of the previous status is registered as boundary. Trips ending at a higher
+mileage belong to the next cycle.
+
+Aggregates are TripRecords with
+- id and startMileage_km of the first trip
+- tripEndTimestamp and overallMileage_km of the last trip
+- mileage_km and travelTime summed up
+- average consumptions weighted by distance
+- averageSpeed_kmph from total distance and travel time
+
+An open aggregate is updated with every new trip. Since its tripEndTimestamp
+changes, it is exported again, as WeConnect aggregates are.
+
+Open aggregates, refuelling boundaries and the IDs of aggregated trips
+are stored as JSON file, so that aggregation continues after a restart.
+"""
+
+import datetime
+import json
+import os
+from weconnect.elements.trip import Trip
+import logging_plus
+from .tripRecord import TripRecord
+from .tripState import RETENTION_DAYS
+
+logger = logging_plus.getLogger("main")
+
+# Trip types built locally
+AGGREGATEDTYPES = (Trip.TripType.LONGTERM, Trip.TripType.CYCLIC)
+
+# Averages weighted by distance
+WEIGHTEDFIELDS = (
+    "averageFuelConsumption",
+    "averageElectricConsumption",
+    "averageAuxConsumption",
+    "averageRecuperation",
+)
+
+
+class TripAggregator:
+    """
+    Long-term and cyclic aggregates per VIN
+    """
+
+    def __init__(
+        self, path: str, refuelThreshold: float = 10, retentionDays: int = RETENTION_DAYS
+    ):
+        """
+        path:            state file
+        refuelThreshold: min. rise of the fuel level (percentage points) regarded as refuelling
+        retentionDays:   number of days for which IDs of aggregated trips are retained
+        """
+        self.path = path
+        self.refuelThreshold = refuelThreshold
+        self.retention = datetime.timedelta(days=retentionDays)
+        self.state = {}
+        self.load()
+
+    def load(self):
+        """
+        Restore state from file
+        """
+        self.state = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.state = json.load(f)
+                logger.debug("Trip aggregation state restored from %s", self.path)
+            except (OSError, ValueError) as error:
+                logger.error(
+                    "Trip aggregation state could not be read from %s: %s", self.path, error
+                )
+                self.state = {}
+
+    def save(self):
+        """
+        Persist state atomically
+        """
+        if not self.path:
+            return
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.path)
+
+    def _vinState(self, vin: str):
+        return self.state.setdefault(
+            vin,
+            {
+                "fuelLevel": None,
+                "mileage": None,
+                "boundaries": [],
+                "cycle": 0,
+                "lastEnd": None,
+                "ids": {},
+                "aggregates": {},
+            },
+        )
+
+    def observeStatus(self, vin: str, mileage, fuelLevel):
+        """
+        Register the car status of a cycle and detect refuelling
+        """
+        if fuelLevel is None:
+            return
+        state = self._vinState(vin)
+        lastFuelLevel = state["fuelLevel"]
+        lastMileage = state["mileage"]
+        if (
+            lastFuelLevel is not None
+            and lastMileage is not None
+            and fuelLevel - lastFuelLevel >= self.refuelThreshold
+        ):
+            logger.info("Refuelling of %s detected at %s km", vin, lastMileage)
+            state["boundaries"].append(lastMileage)
+        if mileage is None:
+            mileage = lastMileage
+        if (fuelLevel, mileage) != (lastFuelLevel, lastMileage):
+            state["fuelLevel"] = fuelLevel
+            state["mileage"] = mileage
+            self.save()
+
+    def addTrips(self, vin: str, trips):
+        """
+        Add short-term trips to the aggregates of a car
+
+        Trips which have already been aggregated are ignored.
+        Returns dict trip type value -> list of updated aggregates (TripRecords)
+        """
+        state = self._vinState(vin)
+        lastEnd = None
+        if state["lastEnd"]:
+            lastEnd = datetime.datetime.fromisoformat(state["lastEnd"])
+        newTrips = [
+            trip
+            for trip in trips
+            if trip.tripEndTimestamp is not None
+            and trip.mileage_km is not None
+            and str(trip.id) not in state["ids"]
+            and (lastEnd is None or trip.tripEndTimestamp >= lastEnd - self.retention)
+        ]
+        newTrips.sort(key=lambda trip: trip.tripEndTimestamp)
+
+        # trip type value -> aggregate id -> latest version
+        updated = {tripType.value: {} for tripType in AGGREGATEDTYPES}
+        for trip in newTrips:
+            # Refuelling boundaries passed by this trip start a new cycle
+            while (
+                state["boundaries"]
+                and trip.overallMileage_km is not None
+                and trip.overallMileage_km > state["boundaries"][0]
+            ):
+                state["boundaries"].pop(0)
+                state["cycle"] = state["cycle"] + 1
+            periods = {
+                Trip.TripType.LONGTERM: trip.tripEndTimestamp.strftime("%Y-%m"),
+                Trip.TripType.CYCLIC: state["cycle"],
+            }
+            for tripType in AGGREGATEDTYPES:
+                aggregate = state["aggregates"].get(tripType.value)
+                if aggregate is None or aggregate["period"] != periods[tripType]:
+                    aggregate = _newAggregate(periods[tripType], trip)
+                    state["aggregates"][tripType.value] = aggregate
+                _addTrip(aggregate, trip)
+                updated[tripType.value][aggregate["id"]] = _record(tripType, aggregate)
+
+            state["ids"][str(trip.id)] = trip.tripEndTimestamp.isoformat()
+            if lastEnd is None or trip.tripEndTimestamp > lastEnd:
+                lastEnd = trip.tripEndTimestamp
+
+        if newTrips:
+            state["lastEnd"] = lastEnd.isoformat()
+            limit = lastEnd - self.retention
+            state["ids"] = {
+                tripId: tripEnd
+                for tripId, tripEnd in state["ids"].items()
+                if datetime.datetime.fromisoformat(tripEnd) >= limit
+            }
+            self.save()
+            logger.debug("%s trips of %s aggregated", len(newTrips), vin)
+        return {tripType: list(records.values()) for tripType, records in updated.items()}
+
+
+def _newAggregate(period, trip: TripRecord):
+    return {
+        "period": period,
+        "id": trip.id,
+        "vehicleType": trip.vehicleType,
+        "startMileage": trip.startMileage_km,
+        "overallMileage": None,
+        "end": None,
+        "mileage": 0,
+        "travelTime": 0,
+        # field -> [sum of average * distance, distance]
+        "weighted": {name: [0.0, 0] for name in WEIGHTEDFIELDS},
+    }
+
+
+def _addTrip(aggregate: dict, trip: TripRecord):
+    aggregate["end"] = trip.tripEndTimestamp.isoformat()
+    if trip.overallMileage_km is not None:
+        aggregate["overallMileage"] = trip.overallMileage_km
+    aggregate["mileage"] = aggregate["mileage"] + trip.mileage_km
+    aggregate["travelTime"] = aggregate["travelTime"] + (trip.travelTime or 0)
+    for name in WEIGHTEDFIELDS:
+        value = getattr(trip, name)
+        if value is not None:
+            weighted = aggregate["weighted"][name]
+            weighted[0] = weighted[0] + value * trip.mileage_km
+            weighted[1] = weighted[1] + trip.mileage_km
+
+
+def _record(tripType: Trip.TripType, aggregate: dict):
+    averages = {}
+    for name, (total, distance) in aggregate["weighted"].items():
+        averages[name] = round(total / distance, 1) if distance else None
+    averageSpeed = None
+    if aggregate["travelTime"]:
+        averageSpeed = round(aggregate["mileage"] * 60 / aggregate["travelTime"])
+    return TripRecord(
+        id=aggregate["id"],
+        tripEndTimestamp=datetime.datetime.fromisoformat(aggregate["end"]),
+        tripType=tripType.value,
+        vehicleType=aggregate["vehicleType"],
+        mileage_km=aggregate["mileage"],
+        startMileage_km=aggregate["startMileage"],
+        overallMileage_km=aggregate["overallMileage"],
+        travelTime=aggregate["travelTime"],
+        averageSpeed_kmph=averageSpeed,
+        **averages,
+    )
@@ -0,0 +1,47 @@
+"""
+Module tripCache
+
+Cache for WeConnect trip responses.
+
+For every VIN and trip type, a hash of the last processed payload is kept.
+If WeConnect returns an identical payload, parsing and export can be skipped.
+"""
+
+import hashlib
+import json
+
+
+class TripCache:
+    """
+    Hash of last processed trip payload per VIN and trip type
+    """
+
+    def __init__(self):
+        self.hashes = {}
+
+    @staticmethod
+    def payloadHash(data):
+        """
+        Hash of a JSON payload independent of key order
+        """
+        return hashlib.sha1(
+            json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def changed(self, vin: str, tripType: str, data):
+        """
+        Check whether data differ from the last processed payload
+        """
+        return self.hashes.get((vin, tripType)) != self.payloadHash(data)
+
+    def commit(self, vin: str, tripType: str, data):
+        """
+        Register data as processed
+        """
+        self.hashes[(vin, tripType)] = self.payloadHash(data)
+
+    def invalidate(self):
+        """
+        Forget all payloads
+        """
+        self.hashes = {}
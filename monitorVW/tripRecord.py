@@ -0,0 +1,105 @@
+"""
+Module tripRecord
+
+Compact trip records parsed directly from WeConnect trip lists.
+
+weconnect Trip objects attach an attribute tree with observers to the vehicle
+for every trip. For export, only the plain values are needed.
+A TripRecord is an immutable tuple holding these values, converted in the same way
+as weconnect does (int, float, datetime; enums as their string values).
+Records are independent of the vehicle and can be built in any thread.
+"""
+
+import datetime
+from typing import NamedTuple
+from weconnect.elements.enums import CarType
+from weconnect.elements.trip import Trip
+from weconnect.util import robustTimeParse
+
+
+class TripRecord(NamedTuple):
+    """
+    Values of one trip
+    """
+
+    id: int
+    tripEndTimestamp: datetime.datetime
+    tripType: str
+    vehicleType: str
+    mileage_km: int
+    startMileage_km: int
+    overallMileage_km: int
+    travelTime: int
+    averageFuelConsumption: float
+    averageElectricConsumption: float
+    averageSpeed_kmph: int
+    averageAuxConsumption: float
+    averageRecuperation: float
+
+
+def _enumValue(enumType):
+    values = {member.value for member in enumType}
+
+    def convert(value):
+        return value if value in values else enumType.UNKNOWN.value
+
+    return convert
+
+
+# Conversion of JSON values per field, in the order of TripRecord
+CONVERTERS = tuple(
+    zip(
+        TripRecord._fields,
+        (
+            int,
+            robustTimeParse,
+            _enumValue(Trip.TripType),
+            _enumValue(CarType),
+            int,
+            int,
+            int,
+            int,
+            float,
+            float,
+            int,
+            float,
+            float,
+        ),
+    )
+)
+
+
+def parseTrip(data: dict):
+    """
+    Build a TripRecord from one element of a trip list
+
+    Missing, null and empty values are None. Unknown keys are ignored.
+    """
+    values = []
+    for name, convert in CONVERTERS:
+        value = data.get(name)
+        if value is None or value == "":
+            values.append(None)
+        else:
+            values.append(convert(value))
+    return TripRecord._make(values)
+
+
+def parseTrips(data):
+    """
+    Build TripRecords from a trip list response
+
+    Returns an empty list if data contain no trips.
+    """
+    if data is None or "data" not in data:
+        return []
+    return [parseTrip(element) for element in data["data"]]
+
+
+def csvValue(value):
+    """
+    Format a value for csv output as weconnect attributes are formatted
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
@@ -0,0 +1,137 @@
+"""
+Module tripState
+
+Persistent high-water-mark for trips which have already been exported.
+
+For every vehicle (VIN) and trip type, the state keeps
+- the latest tripEndTimestamp seen so far (watermark)
+- the IDs of trips seen within a retention period before the watermark,
+  together with their tripEndTimestamp
+
+A trip is considered new if its ID is unknown or if its tripEndTimestamp
+has changed since it was last exported (aggregated long-term or cyclic trips
+are updated by WeConnect while they are open).
+
+The state is stored as JSON file and restored on restart.
+"""
+
+import datetime
+import json
+import os
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+# Number of days before the watermark for which trip IDs are retained
+RETENTION_DAYS = 30
+
+
+class TripState:
+    """
+    High-water-mark per VIN and trip type
+    """
+
+    def __init__(self, path: str, retentionDays: int = RETENTION_DAYS):
+        self.path = path
+        self.retention = datetime.timedelta(days=retentionDays)
+        self.state = {}
+        self.load()
+
+    def load(self):
+        """
+        Restore state from file
+        """
+        self.state = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.state = json.load(f)
+                logger.debug("Trip state restored from %s", self.path)
+            except (OSError, ValueError) as error:
+                logger.error("Trip state could not be read from %s: %s", self.path, error)
+                self.state = {}
+
+    def save(self):
+        """
+        Persist state atomically
+        """
+        if not self.path:
+            return
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.path)
+        logger.debug("Trip state saved to %s", self.path)
+
+    def _entry(self, vin: str, tripType: str):
+        return self.state.setdefault(vin, {}).setdefault(
+            tripType, {"lastEnd": None, "ids": {}}
+        )
+
+    def watermark(self, vin: str, tripType: str):
+        """
+        Return latest tripEndTimestamp exported for VIN and trip type, or None
+        """
+        entry = self.state.get(vin, {}).get(tripType)
+        if entry and entry["lastEnd"]:
+            return datetime.datetime.fromisoformat(entry["lastEnd"])
+        return None
+
+    def isNew(self, vin: str, tripType: str, tripId, tripEnd: datetime.datetime):
+        """
+        Check whether a trip has not yet been exported
+
+        Trips without tripEnd are never new, since they cannot be exported.
+        """
+        if tripEnd is None:
+            return False
+        entry = self.state.get(vin, {}).get(tripType)
+        if not entry:
+            return True
+        if entry["lastEnd"]:
+            lastEnd = datetime.datetime.fromisoformat(entry["lastEnd"])
+            if tripEnd < lastEnd - self.retention:
+                # Older than anything we still remember: exported before
+                return False
+        return entry["ids"].get(str(tripId)) != tripEnd.isoformat()
+
+    def newTrips(self, vin: str, tripType: str, trips):
+        """
+        Filter a list of TripRecords down to those not yet exported
+        """
+        return [
+            trip
+            for trip in trips
+            if self.isNew(vin, tripType, trip.id, trip.tripEndTimestamp)
+        ]
+
+    def commit(self, vin: str, tripType: str, trips):
+        """
+        Register trips as exported, advance watermark and prune expired IDs
+        """
+        if not trips:
+            return
+        entry = self._entry(vin, tripType)
+        lastEnd = None
+        if entry["lastEnd"]:
+            lastEnd = datetime.datetime.fromisoformat(entry["lastEnd"])
+        for trip in trips:
+            tripEnd = trip.tripEndTimestamp
+            if tripEnd is None:
+                continue
+            entry["ids"][str(trip.id)] = tripEnd.isoformat()
+            if lastEnd is None or tripEnd > lastEnd:
+                lastEnd = tripEnd
+        if lastEnd is None:
+            return
+        entry["lastEnd"] = lastEnd.isoformat()
+
+        limit = lastEnd - self.retention
+        entry["ids"] = {
+            tripId: tripEnd
+            for tripId, tripEnd in entry["ids"].items()
+            if datetime.datetime.fromisoformat(tripEnd) >= limit
+        }
+        self.save()
@@ -0,0 +1,210 @@
+"""
+Module weconSession
+
+WeConnect session for one account.
+
+One session is shared by all vehicles of the account, so that login and
+update are done once per account and cycle, regardless of the number of vehicles.
+
+Vehicle state is refreshed through refresh(), which issues at most one forced
+update per cycle for the configured domains (plus domains requested on demand).
+Data updated during login are fresh for the rest of the cycle.
+
+If a token file is given, OAuth tokens are persisted and reused after a restart
+instead of doing a full login. Access tokens are renewed with the refresh token
+shortly before they expire.
+"""
+
+import os
+import time
+from weconnect import weconnect
+from weconnect.domain import Domain
+from weconnect.errors import AuthentificationError
+import logging_plus
+
+logger = logging_plus.getLogger("main")
+
+# Time (sec) before expiry at which access tokens are renewed
+TOKENRENEWMARGIN = 300
+
+
+class WeConnectSession:
+    """
+    WeConnect login session for one account and the requested vehicles
+    """
+
+    def __init__(
+        self,
+        account: dict,
+        tokenFile: str = None,
+        renewMargin: int = TOKENRENEWMARGIN,
+        domains: list = None,
+    ):
+        """
+        account:     dict with weconUsername, weconPassword, weconSPin
+                     and weconCarId (list of VINs)
+        tokenFile:   file for persistence of tokens (None: no persistence)
+        renewMargin: time (sec) before expiry at which tokens are renewed
+        domains:     list of Domain to be refreshed in every cycle
+                     (default: measurements)
+        """
+        self.account = account
+        self.domains = set(domains or [Domain.MEASUREMENTS])
+        self.freshDomains = set()
+        self.lastUpdate = None
+        self.tokenFile = tokenFile
+        self.renewMargin = renewMargin
+        self.username = account["weconUsername"]
+        self.requestedVins = account["weconCarId"]
+        self.vwc = None
+        self.vins = []
+        self.loggedIn = False
+        # True if the last login() required a full login
+        self.fullLogin = False
+
+    def tokensStored(self):
+        """
+        Check whether stored tokens are available, so that login() can reuse them
+        """
+        return bool(self.tokenFile) and os.path.exists(self.tokenFile)
+
+    def login(self):
+        """
+        Instantiate connection to WE Connect and look up requested vehicles
+        """
+        logger.debug("Instantiating WeConnect vwc for %s", self.username)
+        self.fullLogin = False
+        self.vwc = weconnect.WeConnect(
+            username=self.username,
+            password=self.account["weconPassword"],
+            tokenfile=self.tokenFile,
+            updateAfterLogin=False,
+            loginOnInit=False,
+        )
+        logger.debug("WeConnect vwc instantiated")
+        if self.vwc.session.authorized and self.vwc.session.refreshToken:
+            # Reuse tokens from previous session; fall back to login if rejected
+            logger.debug("Reusing stored WeConnect tokens")
+            try:
+                self.renewTokens()
+                self.refresh()
+            except AuthentificationError as error:
+                logger.info("Stored tokens rejected (%s). Logging in", error)
+                self.freshDomains = set()
+                self.fullLogin = True
+                self.vwc.login()
+                self.refresh()
+        else:
+            self.fullLogin = True
+            self.vwc.login()
+            logger.debug("WeConnect login successful")
+            logger.debug("Updating")
+            self.refresh()
+        logger.debug("Update completed")
+        self.persistTokens()
+
+        # Get cars to query
+        logger.debug("Searching cars in registered cars")
+        self.vins = []
+        for vin in self.requestedVins:
+            if vin in self.vwc.vehicles:
+                self.vins.append(vin)
+                logger.debug("got car %s", vin)
+            else:
+                raise ValueError(
+                    "Requested car not registered at WeConnect: " + vin
+                )
+        self.loggedIn = True
+
+    def renewTokens(self):
+        """
+        Renew access token with the refresh token if it expires soon
+        """
+        session = self.vwc.session
+        if session.expiresAt is None or not session.refreshToken:
+            return
+        if session.expiresAt - time.time() < self.renewMargin:
+            logger.debug("Renewing WeConnect tokens for %s", self.username)
+            session.refresh()
+            self.persistTokens()
+
+    def persistTokens(self):
+        """
+        Write tokens to the token file, readable for the owner only
+        """
+        if not self.tokenFile or not self.vwc:
+            return
+        oldUmask = os.umask(0o077)
+        try:
+            self.vwc.persistTokens()
+        finally:
+            os.umask(oldUmask)
+        if os.path.exists(self.tokenFile):
+            os.chmod(self.tokenFile, 0o600)
+
+    def beginCycle(self):
+        """
+        Start a new cycle: vehicle data of the previous cycle become stale
+        """
+        self.freshDomains = set()
+
+    def isFresh(self, domains: list = None):
+        """
+        Check whether data of the configured and the given domains
+        have been updated in the current cycle
+        """
+        return not self._missing(domains)
+
+    def _missing(self, domains: list = None):
+        return (self.domains | set(domains or [])) - self.freshDomains
+
+    def refresh(self, domains: list = None):
+        """
+        Update vehicle state of all vehicles of the account
+
+        Only domains which have not yet been updated in the current cycle
+        are requested, all of them with one forced update.
+        domains: additional domains required on demand
+
+        Returns True if an update was done.
+        """
+        missing = self._missing(domains)
+        if not missing:
+            logger.debug("Vehicle data of %s are fresh", self.username)
+            return False
+        self.update(sorted(missing, key=lambda domain: domain.value))
+        self.freshDomains = self.freshDomains | missing
+        self.lastUpdate = time.time()
+        return True
+
+    def update(self, domains: list):
+        """
+        Forced update of the given domains of all vehicles of the account
+        """
+        logger.debug(
+            "Updating %s for %s", [domain.value for domain in domains], self.username
+        )
+        self.vwc.update(
+            updateCapabilities=False,
+            updatePictures=False,
+            force=True,
+            selective=domains,
+        )
+
+    def vehicles(self):
+        """
+        Return (vin, vehicle) for all requested vehicles
+        """
+        return [(vin, self.vwc.vehicles[vin]) for vin in self.vins]
+
+    def logout(self):
+        """
+        Drop the WeConnect handle in order to force a new login
+        """
+        if self.vwc:
+            self.persistTokens()
+            del self.vwc
+        self.vwc = None
+        self.vins = []
+        self.loggedIn = False
+        self.freshDomains = set()